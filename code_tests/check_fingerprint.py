@@ -0,0 +1,114 @@
+"""
+Automated check of near-duplicate detection on the recordings of
+`code_tests/sons`: a trimmed, transcoded and noisy copy is the same call, an
+excerpt and a different call sharing the greeting and the hold music are only
+linked, an unrelated call does not match.
+
+    uv run python -m code_tests.check_fingerprint
+"""
+
+import os
+import tempfile
+
+import av
+import numpy as np
+from scipy.signal import resample_poly
+
+from web import fingerprint
+
+SONS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "sons")
+SAMPLE_RATE = fingerprint.SAMPLE_RATE
+
+
+def load(name: str) -> np.ndarray:
+    """Mono 16 kHz float32 waveform of a recording."""
+    resampler = av.AudioResampler(format="flt", layout="mono", rate=SAMPLE_RATE)
+    with av.open(os.path.join(SONS_DIR, name)) as container:
+        chunks = [
+            frame.to_ndarray().ravel()
+            for packet in container.decode(audio=0)
+            for frame in resampler.resample(packet)
+        ]
+    return np.concatenate(chunks)
+
+
+def seconds(waveform: np.ndarray, start: float, end: float | None = None):
+    stop = None if end is None else int(end * SAMPLE_RATE)
+    return waveform[int(start * SAMPLE_RATE) : stop]
+
+
+def telephony_copy(waveform: np.ndarray, *, snr_db: float = 20.0) -> np.ndarray:
+    """Re-export through an 8 kHz mu-law channel, plus white noise."""
+    narrow = resample_poly(waveform, 1, 2)
+    peak = np.abs(narrow).max() or 1.0
+    mu = 255.0
+    companded = np.sign(narrow) * np.log1p(mu * np.abs(narrow / peak)) / np.log1p(mu)
+    companded = np.round(companded * 127) / 127
+    narrow = peak * np.sign(companded) * np.expm1(np.abs(companded) * np.log1p(mu)) / mu
+    copy = resample_poly(narrow, 2, 1).astype(np.float32)
+
+    rng = np.random.default_rng(0)
+    noise_power = np.mean(copy**2) / 10 ** (snr_db / 10)
+    return copy + rng.normal(0, np.sqrt(noise_power), len(copy)).astype(np.float32)
+
+
+def hold_music(duration: float) -> np.ndarray:
+    """Looping chords, as played while the customer waits."""
+    chords = [(261.6, 329.6, 392.0), (220.0, 261.6, 329.6), (174.6, 220.0, 261.6)]
+    t = np.arange(int(0.5 * SAMPLE_RATE)) / SAMPLE_RATE
+    notes = [
+        sum(np.sin(2 * np.pi * f * h * t) / h for f in chord for h in (1, 2, 3))
+        for chord in chords
+    ]
+    loop = np.concatenate(notes) * 0.05
+    repeats = int(np.ceil(duration * SAMPLE_RATE / len(loop)))
+    return np.tile(loop, repeats)[: int(duration * SAMPLE_RATE)].astype(np.float32)
+
+
+def lookup(waveform: np.ndarray):
+    return fingerprint.find_duplicate(*fingerprint.fingerprint(waveform))
+
+
+def main():
+    with tempfile.TemporaryDirectory() as directory:
+        os.environ["FINGERPRINT_DB"] = os.path.join(directory, "fingerprints.db")
+        index = fingerprint.get_index()
+
+        call = load("Ciel mon mari.mp4")
+        other = load("Je brise la glace.mp4")
+
+        # Appel stocké : accueil, musique d'attente, puis la conversation
+        greeting = seconds(call, 0, 10)
+        music = hold_music(30)
+        stored = np.concatenate([greeting, music, seconds(call, 10)])
+        stored_id = index.add(*fingerprint.fingerprint(stored), options={}, result={})
+
+        # Conversation absente de l'index, puis stockée à son tour
+        match = lookup(seconds(other, 0, 100))
+        print(f"[CHECK] sans rapport : {match}")
+        assert match is None, match
+        index.add(
+            *fingerprint.fingerprint(seconds(other, 0, 100)), options={}, result={}
+        )
+
+        cases = {
+            # Copie réexportée, tronquée de 3 s au début et 5 s à la fin
+            "copie": (telephony_copy(seconds(stored, 3, -5)), True),
+            # Extrait d'une minute du même appel
+            "extrait": (seconds(stored, 100, 160), False),
+            # Autre conversation, même accueil et même musique d'attente
+            "accueil commun": (
+                np.concatenate([greeting, music, seconds(other, 100)]),
+                False,
+            ),
+        }
+        for name, (waveform, same) in cases.items():
+            match = lookup(waveform)
+            print(f"[CHECK] {name} : {match}")
+            assert match is not None and match["id"] == stored_id, name
+            assert match["same"] is same, f"{name} : same={match['same']}"
+    print("[CHECK] OK")
+
+
+if __name__ == "__main__":
+    main()
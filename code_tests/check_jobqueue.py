@@ -0,0 +1,123 @@
+"""
+Automated check of the shared job queue with several worker processes on one
+machine: leases, heartbeats, requeue after a killed worker, final failure
+after `max_attempts`, and cleanup of the spooled audio.
+
+    uv run python -m code_tests.check_jobqueue
+"""
+
+import multiprocessing
+import os
+import tempfile
+import time
+
+from web.jobqueue import (
+    STATUS_DONE,
+    STATUS_FAILED,
+    SQLiteJobQueue,
+)
+
+LEASE = 1.0
+MAX_ATTEMPTS = 2
+
+
+def hanging_worker(db_path, worker_id, claimed):
+    """Claim one job and hang without heartbeats, until killed."""
+    queue = SQLiteJobQueue(db_path, max_attempts=MAX_ATTEMPTS)
+    while queue.claim(worker_id=worker_id, lease_seconds=LEASE) is None:
+        time.sleep(0.05)
+    claimed.set()
+    time.sleep(3600)
+
+
+def draining_worker(db_path, worker_id, done_ids):
+    """Claim and complete jobs until the queue is empty."""
+    queue = SQLiteJobQueue(db_path, max_attempts=MAX_ATTEMPTS)
+    while True:
+        # Bail long : ici seule l'exclusivité de la prise de job est testée
+        job = queue.claim(worker_id=worker_id, lease_seconds=60)
+        if job is None:
+            return
+        queue.complete(job["id"], worker_id=worker_id, result={"by": worker_id})
+        done_ids.append(job["id"])
+
+
+def kill_after_claim(db_path, worker_id):
+    claimed = multiprocessing.Event()
+    process = multiprocessing.Process(
+        target=hanging_worker, args=(db_path, worker_id, claimed)
+    )
+    process.start()
+    assert claimed.wait(10), f"{worker_id} n'a pas pris le job"
+    process.kill()
+    process.join()
+
+
+def check_killed_worker(db_path):
+    queue = SQLiteJobQueue(db_path, max_attempts=MAX_ATTEMPTS)
+    job_id = queue.enqueue(b"RIFF", options={"filename": "killed.wav"})
+    audio_path = os.path.join(queue.spool_dir, f"{job_id}.wav")
+
+    # Premier worker tué : le bail expire et le job revient en file
+    kill_after_claim(db_path, "worker-1")
+    time.sleep(LEASE * 1.5)
+    job = queue.claim(worker_id="probe", lease_seconds=LEASE)
+    assert job is not None and job["id"] == job_id and job["attempt"] == 2, job
+    queue.fail(job_id, worker_id="probe", error="retry")
+    assert queue.get(job_id)["status"] == STATUS_FAILED
+    assert not os.path.exists(audio_path), "audio du job en échec non supprimé"
+
+    # Deux workers tués de suite : échec définitif à l'expiration du bail
+    job_id = queue.enqueue(b"RIFF", options={"filename": "killed-twice.wav"})
+    audio_path = os.path.join(queue.spool_dir, f"{job_id}.wav")
+    kill_after_claim(db_path, "worker-2")
+    time.sleep(LEASE * 1.5)
+    kill_after_claim(db_path, "worker-3")
+    time.sleep(LEASE * 1.5)
+    assert queue.claim(worker_id="probe", lease_seconds=LEASE) is None
+
+    job = queue.get(job_id)
+    assert job["status"] == STATUS_FAILED and job["attempts"] == MAX_ATTEMPTS, job
+    assert not os.path.exists(audio_path), "audio du job en échec non supprimé"
+    print("[CHECK] Worker tué : job remis en file puis en échec, audio supprimé")
+
+
+def check_concurrent_workers(db_path, *, jobs=40, workers=4):
+    queue = SQLiteJobQueue(db_path, max_attempts=MAX_ATTEMPTS)
+    job_ids = [
+        queue.enqueue(b"RIFF", options={"filename": f"{i}.wav"}) for i in range(jobs)
+    ]
+
+    with multiprocessing.Manager() as manager:
+        done_ids = manager.list()
+        processes = [
+            multiprocessing.Process(
+                target=draining_worker, args=(db_path, f"drain-{i}", done_ids)
+            )
+            for i in range(workers)
+        ]
+        for process in processes:
+            process.start()
+        for process in processes:
+            process.join(60)
+        done_ids = list(done_ids)
+
+    # Chaque job traité exactement une fois
+    assert sorted(done_ids) == sorted(job_ids), "job perdu ou traité deux fois"
+    assert all(queue.get(job_id)["status"] == STATUS_DONE for job_id in job_ids)
+    assert not any(
+        os.path.exists(os.path.join(queue.spool_dir, f"{job_id}.wav"))
+        for job_id in job_ids
+    )
+    print(f"[CHECK] {jobs} jobs répartis sur {workers} workers, chacun traité une fois")
+
+
+def main():
+    with tempfile.TemporaryDirectory() as directory:
+        check_killed_worker(os.path.join(directory, "killed.db"))
+        check_concurrent_workers(os.path.join(directory, "concurrent.db"))
+    print("[CHECK] OK")
+
+
+if __name__ == "__main__":
+    main()
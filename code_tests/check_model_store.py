@@ -0,0 +1,76 @@
+"""
+Offline convert -> load check of the model store: small pyannote checkpoints
+with the layout written by Lightning are converted to safetensors + JSON in a
+temporary store, rebuilt by `load_pyannote_model`, run on one second of
+silence (`model_store.check`) and compared weight by weight.
+
+    uv run python -m code_tests.check_model_store
+"""
+
+import os
+import tempfile
+
+import lightning.pytorch as pl
+import torch
+from pyannote.audio.core.task import Problem, Resolution, Specifications
+from pyannote.audio.models.embedding import WeSpeakerResNet34
+from pyannote.audio.models.segmentation import PyanNet
+
+from web import model_store
+
+SEGMENTATION_SPECIFICATIONS = Specifications(
+    problem=Problem.MONO_LABEL_CLASSIFICATION,
+    resolution=Resolution.FRAME,
+    duration=10.0,
+    warm_up=(0.0, 0.0),
+    classes=["speaker#1", "speaker#2", "speaker#3"],
+    powerset_max_classes=2,
+    permutation_invariant=True,
+)
+EMBEDDING_SPECIFICATIONS = Specifications(
+    problem=Problem.REPRESENTATION, resolution=Resolution.CHUNK, duration=3.0
+)
+
+
+def save_checkpoint(model, specifications, path):
+    """Checkpoint with the keys Lightning and pyannote write on save."""
+    model.specifications = specifications
+    model.setup()
+    checkpoint = {
+        "state_dict": model.state_dict(),
+        "pytorch-lightning_version": pl.__version__,
+        "hyper_parameters": dict(model.hparams),
+    }
+    model.on_save_checkpoint(checkpoint)
+    torch.save(checkpoint, path)
+    return model
+
+
+def main():
+    with tempfile.TemporaryDirectory() as directory:
+        os.environ["MODEL_STORE_DIR"] = directory
+        models = {
+            "segmentation": (
+                PyanNet(sincnet={"stride": 10}),
+                SEGMENTATION_SPECIFICATIONS,
+            ),
+            "vad": (PyanNet(sincnet={"stride": 10}), SEGMENTATION_SPECIFICATIONS),
+            "embedding": (WeSpeakerResNet34(), EMBEDDING_SPECIFICATIONS),
+        }
+        for name, (model, specifications) in models.items():
+            path = os.path.join(directory, f"{name}.ckpt")
+            save_checkpoint(model, specifications, path)
+            model_store.convert_checkpoint(path, name)
+
+        model_store.check()
+
+        for name, (model, _) in models.items():
+            loaded = model_store.load_pyannote_model(name).state_dict()
+            for key, tensor in model.state_dict().items():
+                assert torch.equal(tensor, loaded[key]), f"{name}: {key} différent"
+            print(f"[CHECK] {name} : poids identiques après conversion")
+    print("[CHECK] OK")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,325 @@
+"""
+Admission control for the transcription pipeline.
+
+Each upload is weighted by its audio duration (read from the WAV header) and
+by the real-time factors (RTF = processing seconds / audio seconds) measured
+on the previous calls for every pipeline stage. A device only runs a bounded
+amount of audio at once: requests above the cap wait in a FIFO queue when
+their ETA is acceptable, and are rejected otherwise (HTTP 429 in the web app).
+"""
+
+import math
+import os
+import threading
+import time
+from collections import deque
+
+# RTF a priori par étape, utilisés tant qu'aucune mesure n'est disponible
+DEFAULT_STAGE_RTF = {
+    "cuda": {
+        "preprocess": 0.02,
+        "fingerprint": 0.005,
+        "triage": 0.01,
+        "asr": 0.1,
+        "asr_light": 0.04,
+        "alignment": 0.03,
+        "diarization": 0.03,
+        "sentiment": 0.02,
+        "summary": 0.05,
+    },
+    "cpu": {
+        "preprocess": 0.02,
+        "fingerprint": 0.005,
+        "triage": 0.1,
+        "asr": 1.2,
+        "asr_light": 0.4,
+        "alignment": 0.3,
+        "diarization": 0.3,
+        "sentiment": 0.1,
+        "summary": 0.3,
+    },
+}
+
+
+class AdmissionRejected(Exception):
+    """Raised when a request cannot be admitted within the queue timeout."""
+
+    def __init__(self, *, reason: str, retry_after: float, eta: float):
+        super().__init__(reason)
+        self.reason = reason
+        self.retry_after = retry_after
+        self.eta = eta
+
+
+class AdmissionTicket:
+    """
+    Slot held by an admitted request.
+    Use it as a context manager so the slot is always released.
+    """
+
+    def __init__(self, *, controller, device, audio_seconds, estimated_cost):
+        self.controller = controller
+        self.device = device
+        self.audio_seconds = audio_seconds
+        self.estimated_cost = estimated_cost
+        self.queued_seconds = 0.0
+        self.started_at = None
+        self.expected_end = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.controller.release(self)
+        return False
+
+
+class _DeviceState:
+    def __init__(self):
+        self.inflight_seconds = 0.0
+        self.tickets = []
+        self.waiting = deque()
+        self.admitted = 0
+        self.queued = 0
+        self.rejected = 0
+        self.completed = 0
+        self.total_wait = 0.0
+
+
+class AdmissionController:
+    """
+    Cap the in-flight audio-seconds per device and estimate job costs from
+    rolling per-stage real-time factors.
+    """
+
+    def __init__(
+        self,
+        *,
+        max_inflight_seconds: float,
+        queue_timeout: float,
+        default_duration: float,
+        rtf_window: int = 50,
+    ):
+        self.max_inflight_seconds = max_inflight_seconds
+        self.queue_timeout = queue_timeout
+        self.default_duration = default_duration
+        self.rtf_window = rtf_window
+
+        self._lock = threading.Condition()
+        self._devices = {}
+        self._rtf = {}
+
+    @classmethod
+    def from_env(cls):
+        return cls(
+            max_inflight_seconds=float(
+                os.getenv("ADMISSION_MAX_INFLIGHT_SECONDS", "3600")
+            ),
+            queue_timeout=float(os.getenv("ADMISSION_QUEUE_TIMEOUT", "300")),
+            default_duration=float(os.getenv("ADMISSION_DEFAULT_DURATION", "600")),
+            rtf_window=int(os.getenv("ADMISSION_RTF_WINDOW", "50")),
+        )
+
+    # ======== RTF ========
+
+    def record_stage(
+        self, *, device: str, stage: str, audio_seconds: float, elapsed: float
+    ) -> None:
+        """Record the measured duration of one pipeline stage."""
+        if not audio_seconds or audio_seconds <= 0:
+            return
+        with self._lock:
+            samples = self._rtf.setdefault(
+                (device, stage), deque(maxlen=self.rtf_window)
+            )
+            samples.append(elapsed / audio_seconds)
+
+    def stage_rtf(self, *, device: str) -> dict:
+        """Rolling mean RTF per stage, falling back on the a priori values."""
+        kind = device.split(":", 1)[0]
+        rtf = dict(DEFAULT_STAGE_RTF.get(kind, DEFAULT_STAGE_RTF["cpu"]))
+        with self._lock:
+            for (sample_device, stage), samples in self._rtf.items():
+                if sample_device == device and samples:
+                    rtf[stage] = sum(samples) / len(samples)
+        return rtf
+
+    def estimate_cost(self, *, device: str, audio_seconds: float, stages=None) -> float:
+        """
+        Estimated wall-clock processing time, in seconds.
+        `stages` restricts the estimate to the stages the job will run
+        (all known stages but alignment by default).
+        """
+        rtf = self.stage_rtf(device=device)
+        if stages is None:
+            stages = [stage for stage in rtf if stage != "alignment"]
+        return audio_seconds * sum(rtf.get(stage, 0.0) for stage in stages)
+
+    # ======== ADMISSION ========
+
+    def admit(
+        self, *, device: str, audio_seconds: float | None, stages=None
+    ) -> AdmissionTicket:
+        """
+        Wait for capacity on `device` and return a ticket.
+        Raises AdmissionRejected if the request would wait longer than the
+        queue timeout.
+        """
+        if audio_seconds is None or audio_seconds <= 0:
+            audio_seconds = self.default_duration
+
+        cost = self.estimate_cost(
+            device=device, audio_seconds=audio_seconds, stages=stages
+        )
+        ticket = AdmissionTicket(
+            controller=self,
+            device=device,
+            audio_seconds=audio_seconds,
+            estimated_cost=cost,
+        )
+
+        with self._lock:
+            state = self._devices.setdefault(device, _DeviceState())
+            now = time.monotonic()
+
+            if not self._can_start(state, ticket):
+                wait = self._estimate_wait(state, audio_seconds, now)
+                if wait > self.queue_timeout:
+                    state.rejected += 1
+                    raise AdmissionRejected(
+                        reason="Capacité de traitement atteinte",
+                        retry_after=max(wait - self.queue_timeout, 1.0),
+                        eta=wait + cost,
+                    )
+
+                state.queued += 1
+                state.waiting.append(ticket)
+                deadline = now + self.queue_timeout
+                try:
+                    while not self._can_start(state, ticket):
+                        remaining = deadline - time.monotonic()
+                        if remaining <= 0:
+                            state.rejected += 1
+                            wait = self._estimate_wait(
+                                state, audio_seconds, time.monotonic(), ticket
+                            )
+                            raise AdmissionRejected(
+                                reason="Délai d'attente dépassé",
+                                retry_after=max(wait, 1.0),
+                                eta=wait + cost,
+                            )
+                        self._lock.wait(remaining)
+                finally:
+                    state.waiting.remove(ticket)
+                    # Le suivant dans la file peut peut-être démarrer
+                    self._lock.notify_all()
+
+            now_started = time.monotonic()
+            ticket.queued_seconds = now_started - now
+            ticket.started_at = now_started
+            ticket.expected_end = now_started + cost
+            state.inflight_seconds += audio_seconds
+            state.tickets.append(ticket)
+            state.admitted += 1
+            state.total_wait += ticket.queued_seconds
+
+        return ticket
+
+    def release(self, ticket: AdmissionTicket) -> None:
+        with self._lock:
+            state = self._devices.get(ticket.device)
+            if state is None or ticket not in state.tickets:
+                return
+            state.tickets.remove(ticket)
+            state.inflight_seconds -= ticket.audio_seconds
+            state.completed += 1
+            self._lock.notify_all()
+
+    def _can_start(self, state: _DeviceState, ticket: AdmissionTicket) -> bool:
+        # FIFO : on ne double pas les requêtes déjà en attente
+        if state.waiting and state.waiting[0] is not ticket:
+            return False
+        # Un fichier plus long que le plafond passe seul
+        if not state.tickets:
+            return True
+        return (
+            state.inflight_seconds + ticket.audio_seconds <= self.max_inflight_seconds
+        )
+
+    def _estimate_wait(
+        self, state: _DeviceState, audio_seconds: float, now: float, ticket=None
+    ) -> float:
+        """Time until enough in-flight audio is released to start a request."""
+        ahead = []
+        for waiting in state.waiting:
+            if waiting is ticket:
+                break
+            ahead.append(waiting)
+        needed = (
+            state.inflight_seconds
+            + sum(t.audio_seconds for t in ahead)
+            + audio_seconds
+            - self.max_inflight_seconds
+        )
+        if needed <= 0 or not state.tickets:
+            return sum(t.estimated_cost for t in ahead)
+
+        wait = 0.0
+        for running in sorted(state.tickets, key=lambda t: t.expected_end):
+            wait = max(running.expected_end - now, 0.0)
+            needed -= running.audio_seconds
+            if needed <= 0:
+                return wait
+
+        # Les requêtes en attente devant nous doivent aussi se terminer
+        return wait + sum(t.estimated_cost for t in ahead)
+
+    # ======== STATS ========
+
+    def stats(self) -> dict:
+        """Admission counters and RTF estimates, per device."""
+        with self._lock:
+            devices = list(self._devices.items())
+            measured = {
+                f"{device}/{stage}": len(samples)
+                for (device, stage), samples in self._rtf.items()
+            }
+
+        now = time.monotonic()
+        result = {
+            "max_inflight_seconds": self.max_inflight_seconds,
+            "queue_timeout": self.queue_timeout,
+            "rtf_samples": measured,
+            "devices": {},
+        }
+        for device, state in devices:
+            with self._lock:
+                result["devices"][device] = {
+                    "inflight_seconds": round(state.inflight_seconds, 1),
+                    "inflight_jobs": len(state.tickets),
+                    "waiting_jobs": len(state.waiting),
+                    "admitted": state.admitted,
+                    "queued": state.queued,
+                    "rejected": state.rejected,
+                    "completed": state.completed,
+                    "mean_wait_seconds": (
+                        round(state.total_wait / state.admitted, 2)
+                        if state.admitted
+                        else 0.0
+                    ),
+                    "current_wait_estimate": round(
+                        self._estimate_wait(state, 0.0, now), 1
+                    ),
+                    "stage_rtf": {
+                        stage: round(value, 4)
+                        for stage, value in self.stage_rtf(device=device).items()
+                    },
+                }
+        return result
+
+
+def retry_after_header(error: AdmissionRejected) -> str:
+    return str(int(math.ceil(error.retry_after)))
+
+
+controller = AdmissionController.from_env()
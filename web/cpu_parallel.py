@@ -0,0 +1,220 @@
+"""
+Intra-file parallel transcription for GPU-less nodes.
+
+A single CTranslate2 instance only uses a few cores efficiently. On CPU, the
+recording is split into VAD chunks (at most `chunk_size` seconds each) that
+are decoded by a pool of faster-whisper worker processes, each with its own
+`intra_threads`. Segments are stitched back in chronological order.
+
+Each worker loads the model once, from the same local CTranslate2 files, and
+keeps it for the lifetime of the pool.
+"""
+
+import atexit
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing import get_context
+
+import numpy as np
+from faster_whisper import WhisperModel
+from faster_whisper.vad import VadOptions, get_speech_timestamps
+
+SAMPLE_RATE = 16_000
+
+# Modèle propre à chaque processus worker
+_worker_model = None
+_worker_options = None
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def available_cores() -> int:
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+def intra_threads() -> int:
+    return max(1, int(os.getenv("CPU_INTRA_THREADS", "4")))
+
+
+def worker_count() -> int:
+    default = max(1, available_cores() // intra_threads())
+    return max(1, int(os.getenv("CPU_PARALLEL_WORKERS", str(default))))
+
+
+def enabled(device: str) -> bool:
+    """
+    CPU_PARALLEL: "auto" (default) enables the pool on CPU when at least two
+    workers fit on the machine, "1" forces it, "0" disables it.
+    """
+    mode = os.getenv("CPU_PARALLEL", "auto").lower()
+    if device != "cpu" or mode in {"0", "false", "off"}:
+        return False
+    if mode == "auto":
+        return worker_count() > 1
+    return True
+
+
+def split_chunks(
+    audio: np.ndarray, *, chunk_size: float = 30.0, onset: float = 0.5
+) -> list[tuple[int, int]]:
+    """
+    Split a waveform into (start, end) sample ranges of at most `chunk_size`
+    seconds, cut on the speech boundaries found by the Silero VAD.
+    """
+    max_samples = int(chunk_size * SAMPLE_RATE)
+    speech = get_speech_timestamps(
+        audio,
+        vad_options=VadOptions(threshold=onset, max_speech_duration_s=chunk_size),
+        sampling_rate=SAMPLE_RATE,
+    )
+    if not speech:
+        return [
+            (start, min(start + max_samples, len(audio)))
+            for start in range(0, len(audio), max_samples)
+        ]
+
+    chunks = []
+    chunk_start, chunk_end = speech[0]["start"], speech[0]["end"]
+    for span in speech[1:]:
+        if span["end"] - chunk_start > max_samples:
+            chunks.append((chunk_start, chunk_end))
+            chunk_start = span["start"]
+        chunk_end = span["end"]
+    chunks.append((chunk_start, chunk_end))
+    return chunks
+
+
+def _init_worker(model_name, compute_type, threads, options):
+    global _worker_model, _worker_options
+    _worker_model = WhisperModel(
+        model_name,
+        device="cpu",
+        compute_type=compute_type,
+        cpu_threads=threads,
+        num_workers=1,
+    )
+    _worker_options = options
+
+
+def _transcribe_chunk(offset: float, chunk: np.ndarray) -> list[dict]:
+    segments, _ = _worker_model.transcribe(chunk, **_worker_options)
+    return [
+        {
+            "start": round(offset + segment.start, 3),
+            "end": round(offset + segment.end, 3),
+            "text": segment.text,
+        }
+        for segment in segments
+    ]
+
+
+def _decoding_options(*, language: str, asr_options: dict) -> dict:
+    """Map the WhisperX `asr_options` to faster-whisper `transcribe` kwargs."""
+    options = {
+        key: value
+        for key, value in asr_options.items()
+        if key not in {"temperatures", "suppress_numerals"}
+    }
+    options["temperature"] = asr_options.get("temperatures", [0.0])
+    options["language"] = language
+    options["task"] = "transcribe"
+    # Le découpage VAD est déjà fait en amont
+    options["vad_filter"] = False
+    return options
+
+
+def _get_pool(*, model_name, compute_type, language, asr_options):
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            workers, threads = worker_count(), intra_threads()
+            print(f"[CPU PARALLEL] Starting {workers} workers x {threads} threads")
+            # spawn : CTranslate2 n'est pas fork-safe
+            _pool = ProcessPoolExecutor(
+                max_workers=workers,
+                mp_context=get_context("spawn"),
+                initializer=_init_worker,
+                initargs=(
+                    model_name,
+                    compute_type,
+                    threads,
+                    _decoding_options(language=language, asr_options=asr_options),
+                ),
+            )
+        return _pool
+
+
+def shutdown() -> None:
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown(cancel_futures=True)
+            _pool = None
+
+
+def _discard_pool(pool) -> None:
+    """Drop a broken pool (a worker died) so that the next call restarts one."""
+    global _pool
+    with _pool_lock:
+        if _pool is pool:
+            _pool = None
+    pool.shutdown(wait=False, cancel_futures=True)
+
+
+atexit.register(shutdown)
+
+
+def transcribe(
+    audio: np.ndarray,
+    *,
+    model_name: str,
+    compute_type: str,
+    language: str,
+    asr_options: dict,
+    vad_options: dict,
+    chunks: list[tuple[int, int]] | None = None,
+) -> dict:
+    """
+    Transcribe one recording across the worker pool.
+    `chunks` are (start, end) sample ranges to decode, by default the VAD
+    chunks of `split_chunks`.
+    Returns a WhisperX-like result: {"segments": [...], "language": ...}.
+    """
+    if chunks is None:
+        chunks = split_chunks(
+            audio,
+            chunk_size=vad_options.get("chunk_size", 30),
+            onset=vad_options.get("vad_onset", 0.5),
+        )
+
+    # Un worker tué (OOM...) casse tout le pool : on le recrée une fois
+    for attempt in range(2):
+        pool = _get_pool(
+            model_name=model_name,
+            compute_type=compute_type,
+            language=language,
+            asr_options=asr_options,
+        )
+        try:
+            futures = [
+                pool.submit(_transcribe_chunk, start / SAMPLE_RATE, audio[start:end])
+                for start, end in chunks
+            ]
+
+            # Les futures sont dans l'ordre des chunks : recollage chronologique
+            segments = []
+            for future in futures:
+                segments.extend(future.result())
+        except BrokenProcessPool:
+            _discard_pool(pool)
+            if attempt:
+                raise
+            print("[CPU PARALLEL WARNING] Worker pool broken, restarting it")
+            continue
+        return {"segments": segments, "language": language}
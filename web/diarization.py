@@ -0,0 +1,166 @@
+"""
+Speaker diarization helpers.
+
+Speakers are assigned at segment level by overlapping every ASR segment with
+the diarization turns, which avoids running the wav2vec2 forced alignment
+when word timings are not requested. So that a segment never spans a change
+of speaker, the ASR chunks can be cut at the diarization turns beforehand
+(`speaker_turn_chunks`).
+"""
+
+import os
+
+import numpy as np
+import torch
+from whisperx.diarize import DiarizationPipeline
+
+DIARIZE_MODEL = "pyannote/speaker-diarization-3.1"
+
+# Nombre de segments traités par bloc pour borner la matrice d'overlap
+OVERLAP_BLOCK_SIZE = 1024
+
+# Silence maximal entre deux tours d'un même locuteur regroupés en un chunk
+TURN_MERGE_GAP = 1.0
+
+
+def turn_chunks_enabled() -> bool:
+    """ASR_TURN_CHUNKS: cut the ASR chunks at the diarization turns (default)."""
+    return os.getenv("ASR_TURN_CHUNKS", "1").lower() not in {"0", "false", "off"}
+
+
+def load_diarization_pipeline(*, device: str, hf_token: str | None):
+    return DiarizationPipeline(
+        model_name=DIARIZE_MODEL, use_auth_token=hf_token, device=device
+    )
+
+
+def move_diarization_pipeline(diarize_model, device: str):
+    """Move the pyannote pipeline between CPU and GPU (residency manager)."""
+    diarize_model.model.to(torch.device(device))
+    return diarize_model
+
+
+def diarize(
+    diarize_model,
+    audio: np.ndarray,
+    *,
+    min_speakers: int = 2,
+    max_speakers: int = 2,
+):
+    """
+    Run pyannote diarization on a 16 kHz waveform.
+    Returns a DataFrame with `start`, `end` and `speaker` columns, and a dict
+    mapping each speaker label to its cluster centroid embedding.
+    """
+    return diarize_model(
+        audio,
+        min_speakers=min_speakers,
+        max_speakers=max_speakers,
+        return_embeddings=True,
+    )
+
+
+def turns_to_arrays(diarize_df) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Convert diarization turns to (starts, ends, speakers) arrays."""
+    return (
+        diarize_df["start"].to_numpy(dtype=np.float64),
+        diarize_df["end"].to_numpy(dtype=np.float64),
+        diarize_df["speaker"].to_numpy(dtype=object),
+    )
+
+
+def speaker_turn_chunks(
+    turn_starts: np.ndarray,
+    turn_ends: np.ndarray,
+    turn_speakers: np.ndarray,
+    *,
+    chunk_size: float = 30.0,
+) -> list[dict]:
+    """
+    ASR chunks cut at the speaker changes: consecutive turns of one speaker
+    (less than TURN_MERGE_GAP apart) are grouped up to `chunk_size` seconds,
+    and a longer single turn is split evenly. Returns chronological
+    {"start", "end", "speaker"} dicts, in seconds.
+    """
+    chunks = []
+    for index in np.argsort(turn_starts, kind="stable"):
+        start, end = float(turn_starts[index]), float(turn_ends[index])
+        speaker = str(turn_speakers[index])
+        if end <= start:
+            continue
+        last = chunks[-1] if chunks else None
+        if (
+            last is not None
+            and last["speaker"] == speaker
+            and start - last["end"] <= TURN_MERGE_GAP
+            and end - last["start"] <= chunk_size
+        ):
+            last["end"] = max(last["end"], end)
+            continue
+
+        pieces = int(np.ceil((end - start) / chunk_size))
+        bounds = np.linspace(start, end, pieces + 1)
+        chunks.extend(
+            {"start": float(a), "end": float(b), "speaker": speaker}
+            for a, b in zip(bounds[:-1], bounds[1:])
+        )
+    return chunks
+
+
+def assign_segment_speakers(
+    segments: list[dict],
+    *,
+    turn_starts: np.ndarray,
+    turn_ends: np.ndarray,
+    turn_speakers: np.ndarray,
+) -> list[dict]:
+    """
+    Set `speaker` on every segment: the speaker whose turns overlap it the
+    most, or the speaker of the nearest turn when nothing overlaps.
+    Segments are updated in place and returned.
+    """
+    if not segments or len(turn_starts) == 0:
+        return segments
+
+    labels, label_index = np.unique(turn_speakers.astype(str), return_inverse=True)
+    # One-hot (tours x locuteurs) : somme des overlaps par locuteur en un produit
+    one_hot = np.zeros((len(turn_starts), len(labels)), dtype=np.float64)
+    one_hot[np.arange(len(turn_starts)), label_index] = 1.0
+
+    seg_starts = np.array([s["start"] for s in segments], dtype=np.float64)
+    seg_ends = np.array([s["end"] for s in segments], dtype=np.float64)
+    turn_mids = (turn_starts + turn_ends) / 2
+
+    for block in range(0, len(segments), OVERLAP_BLOCK_SIZE):
+        starts = seg_starts[block : block + OVERLAP_BLOCK_SIZE, None]
+        ends = seg_ends[block : block + OVERLAP_BLOCK_SIZE, None]
+
+        overlap = np.minimum(ends, turn_ends[None, :]) - np.maximum(
+            starts, turn_starts[None, :]
+        )
+        np.clip(overlap, 0.0, None, out=overlap)
+
+        per_speaker = overlap @ one_hot
+        best = per_speaker.argmax(axis=1)
+
+        # Aucun overlap : tour le plus proche du milieu du segment
+        no_overlap = per_speaker.max(axis=1) <= 0
+        if no_overlap.any():
+            mids = (starts[no_overlap] + ends[no_overlap]) / 2
+            nearest = np.abs(mids - turn_mids[None, :]).argmin(axis=1)
+            best[no_overlap] = label_index[nearest]
+
+        for offset, speaker in enumerate(best):
+            segments[block + offset]["speaker"] = str(labels[speaker])
+
+    return segments
+
+
+def format_transcript(segments: list[dict]) -> str:
+    """Render segments like the WhisperX `.txt` writer: `[SPEAKER_00]: text`."""
+    lines = []
+    for segment in segments:
+        text = segment["text"].strip()
+        speaker = segment.get("speaker")
+        lines.append(f"[{speaker}]: {text}" if speaker is not None else text)
+    return "\n".join(lines)
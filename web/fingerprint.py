@@ -0,0 +1,418 @@
+"""
+Acoustic fingerprints to detect near-duplicate recordings.
+
+The same conversation often reaches us several times (re-exported by the
+telephony system, transcoded, trimmed by a few seconds, uploaded by two
+agents). An exact hash misses these copies, so each recording gets a
+landmark fingerprint computed from the 16 kHz waveform of `preprocess_audio`:
+spectrogram peaks are paired and every pair (f1, f2, dt) is packed into one
+uint32 hash, with the frame of its first peak as an int32 offset.
+
+`FingerprintIndex` keeps every stored fingerprint in memory as an inverted
+index (sorted hashes, new fingerprints merged in, looked up with
+`np.searchsorted`). A candidate matches when many of its hashes agree on the
+same time shift, which is robust to transcoding and to trimming at either
+end. Only a match covering most of the longer recording counts as the same
+call; a shared excerpt (same greeting, partial copy) is only linked.
+Fingerprints and the analysis of each recording live in one SQLite database.
+In fleet mode it defaults to the shared storage of the job queue, so that
+every worker host and the web tier see the same index.
+"""
+
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+import numpy as np
+from scipy.ndimage import maximum_filter
+from scipy.signal import stft
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+SAMPLE_RATE = 16_000
+N_FFT = 1024
+HOP = 512
+# Bande téléphonique : 300 Hz - 3,4 kHz
+MIN_BIN = 300 * N_FFT // SAMPLE_RATE
+MAX_BIN = 3400 * N_FFT // SAMPLE_RATE
+
+# Voisinage (trames, bins) dans lequel un pic doit être le maximum
+PEAK_NEIGHBORHOOD = (15, 21)
+# Marge (log-amplitude) au-dessus de la médiane du spectrogramme
+PEAK_THRESHOLD = 2.0
+# Cibles appariées à chaque pic, dans les DT_MAX trames suivantes
+FAN_OUT = 5
+DT_MAX = 63
+
+FREQ_BITS = 9
+DT_BITS = 6
+
+# Couverture : intervalles de 64 trames (~2 s) contenant au moins
+# COVERAGE_MIN_HASHES hashes alignés, une collision isolée ne compte pas
+COVERAGE_BIN = 64
+COVERAGE_MIN_HASHES = 2
+
+
+def enabled() -> bool:
+    return os.getenv("FINGERPRINT", "1").lower() not in {"0", "false", "off"}
+
+
+def frame_seconds() -> float:
+    return HOP / SAMPLE_RATE
+
+
+# ======== EMPREINTE ========
+
+
+def spectral_peaks(waveform: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """Frames and frequency bins of the spectrogram peaks, sorted by frame."""
+    _, _, spectrum = stft(
+        waveform.astype(np.float32),
+        fs=SAMPLE_RATE,
+        nperseg=N_FFT,
+        noverlap=N_FFT - HOP,
+        boundary=None,
+        padded=False,
+    )
+    # (trames, bins) sur la bande utile
+    log_spectrum = np.log(np.abs(spectrum[MIN_BIN:MAX_BIN].T) + 1e-6)
+    if log_spectrum.size == 0:
+        empty = np.empty(0, dtype=np.int32)
+        return empty, empty
+
+    local_max = maximum_filter(log_spectrum, size=PEAK_NEIGHBORHOOD)
+    is_peak = (log_spectrum == local_max) & (
+        log_spectrum > np.median(log_spectrum) + PEAK_THRESHOLD
+    )
+    frames, bins = np.nonzero(is_peak)
+    return frames.astype(np.int32), (bins + MIN_BIN).astype(np.int32)
+
+
+def fingerprint(waveform: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Landmark hashes of a 16 kHz waveform.
+    Returns (hashes uint32, offsets int32 in frames), one entry per peak pair.
+    """
+    frames, bins = spectral_peaks(waveform)
+    hashes, offsets = [], []
+    # Chaque pic est apparié aux FAN_OUT pics suivants (décalage k)
+    for k in range(1, FAN_OUT + 1):
+        dt = frames[k:] - frames[:-k]
+        keep = (dt > 0) & (dt <= DT_MAX)
+        anchor_bins = bins[:-k][keep].astype(np.uint32)
+        target_bins = bins[k:][keep].astype(np.uint32)
+        hashes.append(
+            (anchor_bins << (FREQ_BITS + DT_BITS))
+            | (target_bins << DT_BITS)
+            | dt[keep].astype(np.uint32)
+        )
+        offsets.append(frames[:-k][keep])
+
+    if not hashes:
+        return np.empty(0, dtype=np.uint32), np.empty(0, dtype=np.int32)
+    return np.concatenate(hashes), np.concatenate(offsets).astype(np.int32)
+
+
+# ======== INDEX ========
+
+
+def retention_seconds() -> float:
+    return float(os.getenv("FINGERPRINT_RETENTION_DAYS", "30")) * 86_400
+
+
+def _covered_bins(offsets: np.ndarray) -> int:
+    """Number of ~2 s intervals holding at least COVERAGE_MIN_HASHES offsets."""
+    if not len(offsets):
+        return 0
+    counts = np.bincount(offsets // COVERAGE_BIN)
+    return int((counts >= COVERAGE_MIN_HASHES).sum())
+
+
+class FingerprintIndex:
+    """
+    SQLite-backed fingerprint store with an in-memory inverted index.
+    Each process loads the fingerprints once, then merges those added since
+    (by itself or by other processes) before each lookup. Recordings older
+    than FINGERPRINT_RETENTION_DAYS are dropped from the index and the base.
+    """
+
+    # Purge des enregistrements expirés au plus une fois par heure
+    PRUNE_INTERVAL = 3600
+
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        self._last_rowid = 0
+        self._pruned_at = 0.0
+        # Par enregistrement indexé (ligne r de l'index)
+        self._recording_ids = []
+        self._hash_counts = []
+        self._bin_counts = []
+        self._created_at = []
+        # Index inversé, trié par hash
+        self._hashes = np.empty(0, dtype=np.uint32)
+        self._rows = np.empty(0, dtype=np.int32)
+        self._offsets = np.empty(0, dtype=np.int32)
+
+        os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+        with self._connect() as conn:
+            conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS recordings (
+                    id TEXT PRIMARY KEY,
+                    hashes BLOB NOT NULL,
+                    offsets BLOB NOT NULL,
+                    options TEXT NOT NULL,
+                    result TEXT NOT NULL,
+                    duplicate_of TEXT,
+                    created_at REAL NOT NULL
+                )
+                """
+            )
+            conn.execute(
+                "CREATE INDEX IF NOT EXISTS recordings_created"
+                " ON recordings (created_at)"
+            )
+
+    @contextmanager
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        try:
+            yield conn
+        finally:
+            conn.close()
+
+    def _refresh(self) -> None:
+        """Merge the fingerprints stored since the last lookup."""
+        now = time.time()
+        if now - self._pruned_at > self.PRUNE_INTERVAL:
+            self._prune(now - retention_seconds())
+            self._pruned_at = now
+
+        with self._connect() as conn:
+            rows = conn.execute(
+                "SELECT rowid, id, hashes, offsets, created_at FROM recordings"
+                " WHERE rowid > ? AND created_at >= ? ORDER BY rowid",
+                (self._last_rowid, now - retention_seconds()),
+            ).fetchall()
+        if not rows:
+            return
+
+        hashes, recordings, offsets = [], [], []
+        for row in rows:
+            row_hashes = np.frombuffer(row["hashes"], dtype=np.uint32)
+            row_offsets = np.frombuffer(row["offsets"], dtype=np.int32)
+            hashes.append(row_hashes)
+            offsets.append(row_offsets)
+            recordings.append(
+                np.full(len(row_hashes), len(self._recording_ids), dtype=np.int32)
+            )
+            self._recording_ids.append(row["id"])
+            self._hash_counts.append(len(row_hashes))
+            self._bin_counts.append(_covered_bins(row_offsets))
+            self._created_at.append(row["created_at"])
+            self._last_rowid = row["rowid"]
+
+        # Seul le nouveau bloc est trié, puis fusionné dans l'index existant
+        new_hashes = np.concatenate(hashes)
+        order = np.argsort(new_hashes, kind="stable")
+        new_hashes = new_hashes[order]
+        positions = np.searchsorted(self._hashes, new_hashes, side="right")
+        self._hashes = np.insert(self._hashes, positions, new_hashes)
+        self._rows = np.insert(self._rows, positions, np.concatenate(recordings)[order])
+        self._offsets = np.insert(
+            self._offsets, positions, np.concatenate(offsets)[order]
+        )
+
+    def _prune(self, cutoff: float) -> None:
+        """Drop the recordings created before `cutoff`, in memory and on disk."""
+        with self._connect() as conn:
+            conn.execute("DELETE FROM recordings WHERE created_at < ?", (cutoff,))
+
+        keep = np.asarray(self._created_at, dtype=np.float64) >= cutoff
+        if keep.all():
+            return
+        # Renumérotation des lignes conservées
+        new_rows = np.cumsum(keep, dtype=np.int32) - 1
+        mask = keep[self._rows]
+        self._hashes = self._hashes[mask]
+        self._offsets = self._offsets[mask]
+        self._rows = new_rows[self._rows[mask]]
+        for name in ("_recording_ids", "_hash_counts", "_bin_counts", "_created_at"):
+            values = getattr(self, name)
+            setattr(self, name, [value for value, k in zip(values, keep) if k])
+
+    def find(self, hashes: np.ndarray, offsets: np.ndarray) -> dict | None:
+        """
+        Best stored recording sharing aligned hashes with the query.
+        Returns {"id", "score", "containment", "coverage", "matches",
+        "offset_seconds"} or None:
+
+        * `containment`: share of the shorter fingerprint found at one time
+          shift (high when one recording is contained in the other),
+        * `score`: the same share of the longer fingerprint,
+        * `coverage`: share of the ~2 s intervals of the longer recording
+          (those holding hashes) where aligned hashes are found,
+        * `offset_seconds`: where the query starts in the match.
+
+        Only `score` and `coverage` both high mean the same recording.
+        """
+        with self._lock:
+            self._refresh()
+            if not len(self._hashes) or not len(hashes):
+                return None
+
+            starts = np.searchsorted(self._hashes, hashes, side="left")
+            ends = np.searchsorted(self._hashes, hashes, side="right")
+            counts = ends - starts
+            if not counts.sum():
+                return None
+
+            # Toutes les entrées de l'index pour chaque hash de la requête
+            query = np.repeat(np.arange(len(hashes)), counts)
+            positions = np.repeat(starts - np.cumsum(counts) + counts, counts)
+            positions += np.arange(len(query))
+            rows = self._rows[positions]
+            shifts = self._offsets[positions] - offsets[query]
+
+            # Histogramme des décalages par enregistrement (clé int64 unique)
+            keys = (rows.astype(np.int64) << 32) | (
+                shifts.astype(np.int64) & 0xFFFFFFFF
+            )
+            values, votes = np.unique(keys, return_counts=True)
+            best = votes.argmax()
+            row = int(values[best] >> 32)
+            shift = int(values[best] & 0xFFFFFFFF)
+            if shift >= 2**31:
+                shift -= 2**32
+            matches = int(votes[best])
+
+            # Intervalles de la requête où les hashes alignés se trouvent
+            aligned = offsets[query[keys == values[best]]]
+            longest = max(_covered_bins(offsets), self._bin_counts[row], 1)
+            hash_counts = (len(hashes), self._hash_counts[row])
+
+            return {
+                "id": self._recording_ids[row],
+                "score": round(matches / max(hash_counts), 3),
+                "containment": round(matches / min(hash_counts), 3),
+                "coverage": round(_covered_bins(aligned) / longest, 3),
+                "matches": matches,
+                "offset_seconds": round(shift * frame_seconds(), 2),
+            }
+
+    def get(self, recording_id: str) -> dict | None:
+        with self._connect() as conn:
+            row = conn.execute(
+                "SELECT options, result, duplicate_of FROM recordings WHERE id = ?",
+                (recording_id,),
+            ).fetchone()
+        if row is None:
+            return None
+        return {
+            "id": recording_id,
+            "options": json.loads(row["options"]),
+            "result": json.loads(row["result"]),
+            "duplicate_of": row["duplicate_of"],
+        }
+
+    def add(
+        self,
+        hashes: np.ndarray,
+        offsets: np.ndarray,
+        *,
+        options: dict,
+        result: dict,
+        duplicate_of: str | None = None,
+    ) -> str:
+        """Store the fingerprint and analysis of a processed recording."""
+        recording_id = str(uuid.uuid4())
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT INTO recordings"
+                " (id, hashes, offsets, options, result, duplicate_of, created_at)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (
+                    recording_id,
+                    hashes.astype(np.uint32).tobytes(),
+                    offsets.astype(np.int32).tobytes(),
+                    json.dumps(options),
+                    json.dumps(result),
+                    duplicate_of,
+                    time.time(),
+                ),
+            )
+        return recording_id
+
+    def stats(self) -> dict:
+        with self._lock:
+            self._refresh()
+            index_bytes = self._hashes.nbytes + self._rows.nbytes + self._offsets.nbytes
+            return {
+                "recordings": len(self._recording_ids),
+                "hashes": len(self._hashes),
+                "index_mb": round(index_bytes / 1024**2, 1),
+                "retention_days": retention_seconds() / 86_400,
+            }
+
+
+_index = None
+_index_lock = threading.Lock()
+
+
+def db_path() -> str:
+    """Fingerprint base, next to JOB_QUEUE_DB in fleet mode (as profile_dir)."""
+    queue_db = os.getenv("JOB_QUEUE_DB")
+    if queue_db:
+        default = os.path.join(
+            os.path.dirname(os.path.abspath(queue_db)), "fingerprints.db"
+        )
+    else:
+        default = os.path.join(BASE_DIR, "data", "fingerprints.db")
+    return os.getenv("FINGERPRINT_DB", default)
+
+
+def get_index() -> FingerprintIndex:
+    global _index
+    with _index_lock:
+        if _index is None:
+            _index = FingerprintIndex(db_path())
+        return _index
+
+
+def min_score() -> float:
+    return float(os.getenv("FINGERPRINT_MIN_SCORE", "0.05"))
+
+
+def min_coverage() -> float:
+    return float(os.getenv("FINGERPRINT_MIN_COVERAGE", "0.8"))
+
+
+def min_matches() -> int:
+    return int(os.getenv("FINGERPRINT_MIN_MATCHES", "50"))
+
+
+def find_duplicate(hashes: np.ndarray, offsets: np.ndarray) -> dict | None:
+    """
+    Stored recording sharing audio with this one, if any. `match["same"]`
+    is True when both are the same conversation (aligned hashes in most of
+    the ~2 s intervals of the longer recording); otherwise one only contains
+    part of the other (same greeting, excerpt) and the match is a link, not
+    a reusable result.
+
+    The hash shares (`score`, `containment`) only decide whether there is a
+    match: a copy trimmed by a fraction of a frame or re-encoded keeps as
+    little as 10-20 % of its hashes, about as many as a long shared excerpt.
+    """
+    match = get_index().find(hashes, offsets)
+    if match is None or match["matches"] < min_matches():
+        return None
+    if match["containment"] < min_score():
+        return None
+    match["same"] = match["coverage"] >= min_coverage()
+    return match
@@ -0,0 +1,301 @@
+"""
+Durable job queue shared by the web tier and the worker fleet.
+
+The web tier only enqueues uploads and serves results; workers (see
+`web/worker.py`), possibly on several hosts, claim jobs under a lease that
+they renew with heartbeats. A job whose lease expires (dead or stuck worker)
+goes back to the queue until `max_attempts` is reached.
+
+`SQLiteJobQueue` stores the jobs in one SQLite database and the uploaded
+audio in a spool directory next to it, both on storage shared by all hosts.
+Other backends only need to implement `JobQueue`.
+"""
+
+import json
+import os
+import sqlite3
+import time
+import uuid
+from abc import ABC, abstractmethod
+from contextlib import contextmanager
+
+STATUS_QUEUED = "queued"
+STATUS_RUNNING = "running"
+STATUS_DONE = "done"
+STATUS_FAILED = "failed"
+
+
+class JobQueue(ABC):
+    @abstractmethod
+    def enqueue(self, audio_data: bytes, *, options: dict) -> str:
+        """Store an upload and return its job id."""
+
+    @abstractmethod
+    def claim(self, *, worker_id: str, lease_seconds: float) -> dict | None:
+        """
+        Lease the oldest queued job to `worker_id`.
+        Returns the job (with `audio_path` and `options`) or None if idle.
+        """
+
+    @abstractmethod
+    def heartbeat(self, job_id: str, *, worker_id: str, lease_seconds: float) -> bool:
+        """Extend the lease. Returns False if the worker lost the job."""
+
+    @abstractmethod
+    def complete(self, job_id: str, *, worker_id: str, result: dict) -> None:
+        """Store the result of a job."""
+
+    @abstractmethod
+    def fail(self, job_id: str, *, worker_id: str, error: str) -> None:
+        """Requeue the job, or mark it failed after `max_attempts`."""
+
+    @abstractmethod
+    def get(self, job_id: str) -> dict | None:
+        """Status and, when finished, result or error of a job."""
+
+    @abstractmethod
+    def stats(self) -> dict:
+        """Number of jobs per status."""
+
+
+class SQLiteJobQueue(JobQueue):
+    """
+    SQLite-backed queue. Every operation opens its own connection, so the
+    queue can be used from several threads and processes. The rollback
+    journal (not WAL) is kept on purpose: WAL needs shared memory and does not
+    work on network filesystems.
+    """
+
+    def __init__(self, db_path: str, *, max_attempts: int = 3):
+        self.db_path = db_path
+        self.spool_dir = os.path.join(
+            os.path.dirname(os.path.abspath(db_path)), "spool"
+        )
+        self.max_attempts = max_attempts
+
+        os.makedirs(self.spool_dir, exist_ok=True)
+        with self._connect() as conn:
+            conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS jobs (
+                    id TEXT PRIMARY KEY,
+                    status TEXT NOT NULL,
+                    options TEXT NOT NULL,
+                    audio_path TEXT NOT NULL,
+                    result TEXT,
+                    error TEXT,
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    worker_id TEXT,
+                    lease_expires REAL,
+                    created_at REAL NOT NULL,
+                    updated_at REAL NOT NULL
+                )
+                """
+            )
+            conn.execute(
+                "CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, created_at)"
+            )
+
+    @contextmanager
+    def _connect(self):
+        # isolation_level=None : autocommit, transactions explicites si besoin
+        conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        try:
+            yield conn
+        finally:
+            conn.close()
+
+    def enqueue(self, audio_data: bytes, *, options: dict) -> str:
+        job_id = str(uuid.uuid4())
+        audio_path = os.path.join(self.spool_dir, f"{job_id}.wav")
+        with open(audio_path, "wb") as f:
+            f.write(audio_data)
+
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT INTO jobs (id, status, options, audio_path, created_at,"
+                " updated_at) VALUES (?, ?, ?, ?, ?, ?)",
+                (job_id, STATUS_QUEUED, json.dumps(options), audio_path, now, now),
+            )
+        return job_id
+
+    def _expire_leases(self, conn: sqlite3.Connection, now: float) -> list[str]:
+        """
+        Requeue the jobs of dead workers (lease expired), or fail them after
+        `max_attempts`. Returns the spool audio of the failed jobs.
+        """
+        expired_paths = [
+            row["audio_path"]
+            for row in conn.execute(
+                "SELECT audio_path FROM jobs"
+                " WHERE status = ? AND lease_expires < ? AND attempts >= ?",
+                (STATUS_RUNNING, now, self.max_attempts),
+            )
+        ]
+        conn.execute(
+            "UPDATE jobs SET status = ?, error = ?, updated_at = ?"
+            " WHERE status = ? AND lease_expires < ? AND attempts >= ?",
+            (
+                STATUS_FAILED,
+                "Bail expiré trop de fois",
+                now,
+                STATUS_RUNNING,
+                now,
+                self.max_attempts,
+            ),
+        )
+        conn.execute(
+            "UPDATE jobs SET status = ?, worker_id = NULL, lease_expires = NULL,"
+            " updated_at = ? WHERE status = ? AND lease_expires < ?",
+            (STATUS_QUEUED, now, STATUS_RUNNING, now),
+        )
+        return expired_paths
+
+    def claim(self, *, worker_id: str, lease_seconds: float) -> dict | None:
+        now = time.time()
+        with self._connect() as conn:
+            # BEGIN IMMEDIATE : un seul worker à la fois prend le verrou d'écriture
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                expired_paths = self._expire_leases(conn, now)
+                row = conn.execute(
+                    "SELECT * FROM jobs WHERE status = ? ORDER BY created_at LIMIT 1",
+                    (STATUS_QUEUED,),
+                ).fetchone()
+                if row is not None:
+                    conn.execute(
+                        "UPDATE jobs SET status = ?, worker_id = ?,"
+                        " lease_expires = ?, attempts = attempts + 1,"
+                        " updated_at = ? WHERE id = ?",
+                        (
+                            STATUS_RUNNING,
+                            worker_id,
+                            now + lease_seconds,
+                            now,
+                            row["id"],
+                        ),
+                    )
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+
+        # Comme _finish : l'audio des jobs définitivement en échec est supprimé
+        for audio_path in expired_paths:
+            if os.path.exists(audio_path):
+                os.remove(audio_path)
+
+        if row is None:
+            return None
+
+        return {
+            "id": row["id"],
+            "audio_path": row["audio_path"],
+            "options": json.loads(row["options"]),
+            "attempt": row["attempts"] + 1,
+        }
+
+    def heartbeat(self, job_id: str, *, worker_id: str, lease_seconds: float) -> bool:
+        now = time.time()
+        with self._connect() as conn:
+            cursor = conn.execute(
+                "UPDATE jobs SET lease_expires = ?, updated_at = ?"
+                " WHERE id = ? AND worker_id = ? AND status = ?",
+                (now + lease_seconds, now, job_id, worker_id, STATUS_RUNNING),
+            )
+        return cursor.rowcount == 1
+
+    def _finish(self, job_id: str, *, worker_id: str, status: str, **fields) -> bool:
+        with self._connect() as conn:
+            cursor = conn.execute(
+                "UPDATE jobs SET status = ?, result = ?, error = ?,"
+                " worker_id = CASE WHEN ? THEN NULL ELSE worker_id END,"
+                " lease_expires = NULL, updated_at = ?"
+                " WHERE id = ? AND worker_id = ? AND status = ?",
+                (
+                    status,
+                    fields.get("result"),
+                    fields.get("error"),
+                    # Job remis en file : il n'appartient plus au worker
+                    status == STATUS_QUEUED,
+                    time.time(),
+                    job_id,
+                    worker_id,
+                    STATUS_RUNNING,
+                ),
+            )
+            row = conn.execute(
+                "SELECT audio_path FROM jobs WHERE id = ?", (job_id,)
+            ).fetchone()
+
+        # L'audio n'est plus utile une fois le job terminé
+        if (
+            cursor.rowcount == 1
+            and status in {STATUS_DONE, STATUS_FAILED}
+            and row is not None
+            and os.path.exists(row["audio_path"])
+        ):
+            os.remove(row["audio_path"])
+        return cursor.rowcount == 1
+
+    def complete(self, job_id: str, *, worker_id: str, result: dict) -> None:
+        self._finish(
+            job_id, worker_id=worker_id, status=STATUS_DONE, result=json.dumps(result)
+        )
+
+    def fail(self, job_id: str, *, worker_id: str, error: str) -> None:
+        with self._connect() as conn:
+            row = conn.execute(
+                "SELECT attempts FROM jobs WHERE id = ?", (job_id,)
+            ).fetchone()
+        retry = row is not None and row["attempts"] < self.max_attempts
+        self._finish(
+            job_id,
+            worker_id=worker_id,
+            status=STATUS_QUEUED if retry else STATUS_FAILED,
+            error=error,
+        )
+
+    def get(self, job_id: str) -> dict | None:
+        with self._connect() as conn:
+            row = conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        if row is None:
+            return None
+        return {
+            "id": row["id"],
+            "status": row["status"],
+            "attempts": row["attempts"],
+            "options": json.loads(row["options"]),
+            "result": json.loads(row["result"]) if row["result"] else None,
+            "error": row["error"],
+            "created_at": row["created_at"],
+            "updated_at": row["updated_at"],
+        }
+
+    def stats(self) -> dict:
+        with self._connect() as conn:
+            rows = conn.execute(
+                "SELECT status, COUNT(*) AS n FROM jobs GROUP BY status"
+            ).fetchall()
+        return {row["status"]: row["n"] for row in rows}
+
+
+_queue = None
+
+
+def get_queue() -> JobQueue | None:
+    """
+    Queue configured by JOB_QUEUE_DB, or None when the web app processes
+    uploads itself.
+    """
+    global _queue
+    db_path = os.getenv("JOB_QUEUE_DB")
+    if not db_path:
+        return None
+    if _queue is None:
+        _queue = SQLiteJobQueue(
+            db_path, max_attempts=int(os.getenv("JOB_MAX_ATTEMPTS", "3"))
+        )
+    return _queue
@@ -1,9 +1,35 @@
 import os
 
-from flask import Flask, jsonify, render_template, request
+from dotenv import load_dotenv
+from flask import (
+    Flask,
+    jsonify,
+    render_template,
+    request,
+    send_from_directory,
+    url_for,
+)
 from werkzeug.utils import secure_filename
 
-from . import patch_lightning, processor
+from . import admission, fingerprint, jobqueue, profiling, voiceprints
+
+# .env lu avant de choisir le mode (JOB_QUEUE_DB, MODEL_STORE_DIR)
+load_dotenv()
+
+# Mode flotte : le web ne fait que mettre en file et servir les résultats,
+# sans pile ML ni store de modèles (le traitement tourne dans web/worker.py)
+if jobqueue.get_queue() is None:
+    from . import model_store
+
+    if model_store.is_prepared():
+        # Store local : démarrage hors ligne, sans chargement pickle
+        model_store.enable_offline()
+    else:
+        from . import patch_lightning  # noqa: F401
+
+    from . import processor
+else:
+    processor = None
 
 # Obtenir le répertoire du script (web/)
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
@@ -40,13 +66,76 @@ def upload_file():
         # Récupérer le choix du premier locuteur
         first_speaker = request.form.get("first_speaker", "maif")
 
-        # Call the external processor module
+        # Horodatage par mot (alignement wav2vec2) uniquement sur demande
+        word_timestamps = request.form.get("word_timestamps", "false").lower() in {
+            "1",
+            "true",
+            "on",
+        }
+
+        # Profilage du job à la demande (en-tête X-Profile ou champ "profile")
+        profile = request.headers.get(
+            "X-Profile", request.form.get("profile", "false")
+        ).lower() in {"1", "true", "on"}
+
+        # Mode flotte : le traitement est délégué aux workers (web/worker.py)
+        queue = jobqueue.get_queue()
+        if queue is not None:
+            job_id = queue.enqueue(
+                audio_data,
+                options={
+                    "filename": filename,
+                    "first_speaker": first_speaker,
+                    "word_timestamps": word_timestamps,
+                    "profile": profile,
+                },
+            )
+            return (
+                jsonify(
+                    {
+                        "message": "Fichier mis en file d'attente",
+                        "filename": filename,
+                        "job_id": job_id,
+                        "status_url": url_for("job_status", job_id=job_id),
+                    }
+                ),
+                202,
+            )
+
+        # Contrôle d'admission selon la durée annoncée par l'en-tête WAV
         try:
-            analysis_result = processor.process_wav(
-                audio_data, first_speaker=first_speaker
+            ticket = admission.controller.admit(
+                device=processor.DEVICE,
+                audio_seconds=processor.get_wav_duration(audio_data),
+                stages=processor.pipeline_stages(word_timestamps=word_timestamps),
+            )
+        except admission.AdmissionRejected as e:
+            return (
+                jsonify(
+                    {
+                        "error": f"Serveur saturé: {e.reason}",
+                        "retry_after": round(e.retry_after, 1),
+                        "eta_seconds": round(e.eta, 1),
+                    }
+                ),
+                429,
+                {"Retry-After": admission.retry_after_header(e)},
             )
-        except Exception as e:
-            return jsonify({"error": f"Erreur lors du traitement: {str(e)}"}), 500
+
+        # Call the external processor module
+        with ticket:
+            try:
+                analysis_result = processor.process_wav(
+                    audio_data,
+                    first_speaker=first_speaker,
+                    word_timestamps=word_timestamps,
+                    profile=profile,
+                )
+            except Exception as e:
+                return (
+                    jsonify({"error": f"Erreur lors du traitement: {str(e)}"}),
+                    500,
+                )
 
         return (
             jsonify(
@@ -54,6 +143,7 @@ def upload_file():
                     "message": "Fichier téléversé avec succès",
                     "filename": filename,
                     "analysis": analysis_result,
+                    "queued_seconds": round(ticket.queued_seconds, 1),
                 }
             ),
             200,
@@ -67,5 +157,96 @@ def upload_file():
         )
 
 
+@app.route("/jobs/<job_id>")
+def job_status(job_id):
+    queue = jobqueue.get_queue()
+    if queue is None:
+        return jsonify({"error": "File de traitement non configurée"}), 404
+    job = queue.get(job_id)
+    if job is None:
+        return jsonify({"error": "Job inconnu"}), 404
+
+    response = {"job_id": job_id, "status": job["status"], "attempts": job["attempts"]}
+    if job["status"] == jobqueue.STATUS_DONE:
+        response.update(job["result"])
+    elif job["status"] == jobqueue.STATUS_FAILED:
+        response["error"] = f"Erreur lors du traitement: {job['error']}"
+    return jsonify(response), 200
+
+
+@app.route("/profiles/<profile_id>/<name>")
+def download_profile(profile_id, name):
+    if name not in {"trace.json", "speedscope.json"}:
+        return jsonify({"error": "Fichier de profil inconnu"}), 404
+    return send_from_directory(
+        os.path.join(profiling.profile_dir(), secure_filename(profile_id)),
+        name,
+        as_attachment=True,
+    )
+
+
+def fleet_mode_error():
+    return (
+        jsonify({"error": "Indisponible en mode flotte : à faire sur un worker"}),
+        404,
+    )
+
+
+@app.route("/stats/residency")
+def residency_stats():
+    if processor is None:
+        return fleet_mode_error()
+    return jsonify(processor.models.metrics())
+
+
+@app.route("/stats/fingerprints")
+def fingerprint_stats():
+    return jsonify(fingerprint.get_index().stats())
+
+
+@app.route("/stats/jobs")
+def job_stats():
+    queue = jobqueue.get_queue()
+    if queue is None:
+        return jsonify({"error": "File de traitement non configurée"}), 404
+    return jsonify(queue.stats())
+
+
+@app.route("/operators", methods=["GET"])
+def list_operators():
+    return jsonify({"operators": voiceprints.get_store().operators()})
+
+
+@app.route("/operators/enroll", methods=["POST"])
+def enroll_operator():
+    if processor is None:
+        return fleet_mode_error()
+    operator_id = request.form.get("operator_id", "").strip()
+    if not operator_id:
+        return jsonify({"error": "Identifiant opérateur manquant"}), 400
+    if "file" not in request.files:
+        return jsonify({"error": "Aucun fichier reçu"}), 400
+    file = request.files["file"]
+    if not allowed_file(file.filename):
+        return (
+            jsonify(
+                {"error": "Type de fichier invalide. Seul le format WAV est autorisé."}
+            ),
+            400,
+        )
+
+    try:
+        samples = processor.enroll_operator(file.read(), operator_id=operator_id)
+    except Exception as e:
+        return jsonify({"error": f"Erreur lors de l'enrôlement: {str(e)}"}), 500
+
+    return jsonify({"operator_id": operator_id, "samples": samples}), 200
+
+
+@app.route("/stats/admission")
+def admission_stats():
+    return jsonify(admission.controller.stats())
+
+
 if __name__ == "__main__":
     app.run(debug=True)
@@ -0,0 +1,354 @@
+"""
+Local model store for fast, offline cold starts.
+
+`prepare` downloads every model of the pipeline once and converts the pyannote
+checkpoints (diarization segmentation, speaker embedding and the WhisperX VAD)
+to safetensors, with their architecture and specifications in JSON. At run
+time the weights are memory-mapped from the safetensors files and assigned to
+the modules without a pickle `torch.load`, so the Lightning monkey-patch
+(`web/patch_lightning.py`) is not needed and the OS page cache is shared by
+every worker process. The Whisper (CTranslate2) and wav2vec2 alignment models
+are stored as-is, and nothing is fetched from the Hugging Face hub.
+
+    uv run python -m web.model_store prepare
+    uv run python -m web.model_store check
+"""
+
+import argparse
+import dataclasses
+import enum
+import importlib
+import inspect
+import json
+import os
+import shutil
+import time
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+WHISPER_REPOS = {
+    "large-v2": "Systran/faster-whisper-large-v2",
+    "small": "Systran/faster-whisper-small",
+    "tiny": "Systran/faster-whisper-tiny",
+}
+DIARIZATION_REPO = "pyannote/speaker-diarization-3.1"
+PYANNOTE_CHECKPOINTS = {
+    "segmentation": ("pyannote/segmentation-3.0", "pytorch_model.bin"),
+    "embedding": ("pyannote/wespeaker-voxceleb-resnet34-LM", "pytorch_model.bin"),
+}
+
+VAD_HYPERPARAMETERS = {"min_duration_on": 0.1, "min_duration_off": 0.1}
+
+# Incrémenté à chaque changement de disposition du store
+# (2 : un dossier whisper-<taille> par modèle, version Lightning dans les JSON)
+MANIFEST_VERSION = 2
+
+
+def store_dir() -> str:
+    return os.getenv("MODEL_STORE_DIR", os.path.join(BASE_DIR, "data", "models"))
+
+
+def _path(*parts) -> str:
+    return os.path.join(store_dir(), *parts)
+
+
+def _manifest() -> dict | None:
+    try:
+        with open(_path("manifest.json"), "r", encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def is_prepared() -> bool:
+    """
+    True when the store was prepared with the current layout. Raises if it
+    was prepared by an older version, rather than loading it wrongly.
+    """
+    manifest = _manifest()
+    if manifest is None:
+        return False
+    if manifest.get("version") != MANIFEST_VERSION:
+        raise RuntimeError(
+            f"Store de modèles {store_dir()} préparé avec une ancienne version"
+            f" (version {manifest.get('version', 1)}, attendue {MANIFEST_VERSION})"
+            " : relancer `python -m web.model_store prepare`"
+        )
+    return True
+
+
+def check_whisper_sizes(sizes) -> None:
+    """Raise if a Whisper model size was not downloaded by `prepare`."""
+    stored = _manifest()["whisper"]
+    missing = sorted(set(sizes) - set(stored))
+    if missing:
+        raise RuntimeError(
+            f"Modèles Whisper absents du store {store_dir()} : {', '.join(missing)}"
+            f" (disponibles : {', '.join(stored)}). Les ajouter à WHISPER_REPOS"
+            " et relancer `python -m web.model_store prepare`"
+        )
+
+
+def enable_offline() -> None:
+    """Forbid hub access; must run before huggingface_hub is imported."""
+    os.environ["HF_HUB_OFFLINE"] = "1"
+    os.environ["TRANSFORMERS_OFFLINE"] = "1"
+
+
+def whisper_path(size: str = "large-v2") -> str:
+    return _path(f"whisper-{size}")
+
+
+def alignment_dir() -> str:
+    return _path("alignment")
+
+
+# ======== MÉTADONNÉES PYANNOTE (JSON) ========
+
+
+def _to_json(value):
+    """Encode pyannote specifications (dataclasses + enums) as plain JSON."""
+    if isinstance(value, enum.Enum):
+        return {
+            "__enum__": f"{type(value).__module__}:{type(value).__qualname__}",
+            "name": value.name,
+        }
+    if dataclasses.is_dataclass(value):
+        return {
+            "__dataclass__": f"{type(value).__module__}:{type(value).__qualname__}",
+            "fields": {
+                field.name: _to_json(getattr(value, field.name))
+                for field in dataclasses.fields(value)
+            },
+        }
+    if isinstance(value, (list, tuple)):
+        return [_to_json(item) for item in value]
+    if isinstance(value, dict):
+        return {key: _to_json(item) for key, item in value.items()}
+    return value
+
+
+def _import(qualified: str):
+    module, name = qualified.split(":")
+    obj = importlib.import_module(module)
+    for attr in name.split("."):
+        obj = getattr(obj, attr)
+    return obj
+
+
+def _from_json(value):
+    if isinstance(value, dict):
+        if "__enum__" in value:
+            return _import(value["__enum__"])[value["name"]]
+        if "__dataclass__" in value:
+            fields = {k: _from_json(v) for k, v in value["fields"].items()}
+            return _import(value["__dataclass__"])(**fields)
+        return {key: _from_json(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [_from_json(item) for item in value]
+    return value
+
+
+# ======== CONVERSION ========
+
+
+def convert_checkpoint(checkpoint_path: str, name: str) -> None:
+    """Split a pyannote Lightning checkpoint into safetensors + JSON."""
+    import torch
+    from safetensors.torch import save_file
+
+    # Seul chargement pickle, une fois, sur un checkpoint connu
+    checkpoint = torch.load(checkpoint_path, map_location="cpu", weights_only=False)
+
+    state_dict = {
+        key: tensor.contiguous() for key, tensor in checkpoint["state_dict"].items()
+    }
+    save_file(state_dict, _path(f"{name}.safetensors"))
+
+    pyannote_meta = checkpoint["pyannote.audio"]
+    specifications = pyannote_meta["specifications"]
+    meta = {
+        "architecture": pyannote_meta["architecture"],
+        "versions": pyannote_meta["versions"],
+        "lightning_version": checkpoint["pytorch-lightning_version"],
+        "hyper_parameters": _to_json(dict(checkpoint.get("hyper_parameters", {}))),
+        "specifications": _to_json(specifications),
+        "specifications_is_tuple": isinstance(specifications, tuple),
+    }
+    with open(_path(f"{name}.json"), "w", encoding="utf-8") as f:
+        json.dump(meta, f, indent=2)
+
+
+def prepare(*, hf_token: str | None) -> None:
+    """Download and convert every model into the store."""
+    import whisperx
+    from huggingface_hub import hf_hub_download, snapshot_download
+
+    os.makedirs(store_dir(), exist_ok=True)
+
+    for size, repo_id in WHISPER_REPOS.items():
+        print(f"[MODEL STORE] Whisper {size} -> {whisper_path(size)}")
+        snapshot_download(repo_id, local_dir=whisper_path(size))
+
+    for name, (repo_id, filename) in PYANNOTE_CHECKPOINTS.items():
+        print(f"[MODEL STORE] {repo_id} -> {name}.safetensors")
+        checkpoint_path = hf_hub_download(repo_id, filename, token=hf_token)
+        convert_checkpoint(checkpoint_path, name)
+
+    print("[MODEL STORE] WhisperX VAD -> vad.safetensors")
+    vad_checkpoint = os.path.join(
+        os.path.dirname(whisperx.__file__), "assets", "pytorch_model.bin"
+    )
+    convert_checkpoint(vad_checkpoint, "vad")
+
+    print(f"[MODEL STORE] {DIARIZATION_REPO} config")
+    config_path = hf_hub_download(DIARIZATION_REPO, "config.yaml", token=hf_token)
+    shutil.copyfile(config_path, _path("diarization.yaml"))
+
+    print(f"[MODEL STORE] Alignment model -> {alignment_dir()}")
+    whisperx.load_align_model(
+        language_code="fr", device="cpu", model_dir=alignment_dir()
+    )
+
+    # Le manifest n'est écrit que si les modèles convertis se rechargent
+    check()
+
+    with open(_path("manifest.json"), "w", encoding="utf-8") as f:
+        json.dump(
+            {
+                "version": MANIFEST_VERSION,
+                "whisper": WHISPER_REPOS,
+                "diarization": DIARIZATION_REPO,
+                "pyannote": {k: v[0] for k, v in PYANNOTE_CHECKPOINTS.items()},
+                "prepared_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            },
+            f,
+            indent=2,
+        )
+    print(f"[MODEL STORE] Ready in {store_dir()}")
+
+
+# ======== CHARGEMENT ========
+
+
+def load_pyannote_model(name: str):
+    """
+    Rebuild a pyannote Model from the store: architecture from JSON, weights
+    memory-mapped from safetensors and assigned in place (no copy).
+    """
+    from safetensors.torch import load_file
+
+    with open(_path(f"{name}.json"), "r", encoding="utf-8") as f:
+        meta = json.load(f)
+
+    architecture = meta["architecture"]
+    model_class = getattr(
+        importlib.import_module(architecture["module"]), architecture["class"]
+    )
+    hyper_parameters = _from_json(meta["hyper_parameters"])
+    # Comme Lightning : seuls les arguments acceptés par le constructeur
+    signature = inspect.signature(model_class.__init__)
+    if not any(
+        param.kind == param.VAR_KEYWORD for param in signature.parameters.values()
+    ):
+        hyper_parameters = {
+            key: value
+            for key, value in hyper_parameters.items()
+            if key in signature.parameters
+        }
+    model = model_class(**hyper_parameters)
+
+    specifications = _from_json(meta["specifications"])
+    if meta["specifications_is_tuple"]:
+        specifications = tuple(specifications)
+    # Même chemin que Lightning : ajoute les couches dépendantes de la tâche
+    model.on_load_checkpoint(
+        {
+            "pytorch-lightning_version": meta["lightning_version"],
+            "pyannote.audio": {
+                "versions": meta["versions"],
+                "architecture": architecture,
+                "specifications": specifications,
+            },
+        }
+    )
+
+    model.load_state_dict(load_file(_path(f"{name}.safetensors")), assign=True)
+    model.eval()
+    return model
+
+
+def load_vad_pipeline(device: str, *, onset: float, offset: float):
+    """WhisperX pyannote VAD built from the stored segmentation model."""
+    import torch
+    from whisperx.vads.pyannote import VoiceActivitySegmentation
+
+    vad_pipeline = VoiceActivitySegmentation(
+        segmentation=load_pyannote_model("vad"), device=torch.device(device)
+    )
+    vad_pipeline.instantiate({"onset": onset, "offset": offset, **VAD_HYPERPARAMETERS})
+    return vad_pipeline
+
+
+def load_diarization_pipeline(device: str):
+    """
+    speaker-diarization-3.1 built from the stored segmentation and embedding
+    models, wrapped in the WhisperX DiarizationPipeline interface.
+    """
+    import torch
+    import yaml
+    from pyannote.audio.pipelines import SpeakerDiarization
+    from whisperx.diarize import DiarizationPipeline
+
+    with open(_path("diarization.yaml"), "r", encoding="utf-8") as f:
+        config = yaml.safe_load(f)
+
+    params = dict(config["pipeline"]["params"])
+    params["segmentation"] = load_pyannote_model("segmentation")
+    params["embedding"] = load_pyannote_model("embedding")
+    pipeline = SpeakerDiarization(**params)
+    pipeline.instantiate(config["params"])
+
+    # DiarizationPipeline charge depuis le hub dans __init__ : on le contourne
+    diarize_model = DiarizationPipeline.__new__(DiarizationPipeline)
+    diarize_model.model = pipeline.to(torch.device(device))
+    return diarize_model
+
+
+# ======== VÉRIFICATION ========
+
+PYANNOTE_MODELS = ("segmentation", "embedding", "vad")
+
+
+def check(names=PYANNOTE_MODELS) -> None:
+    """
+    Smoke check of the converted pyannote models: rebuild each one from the
+    store and run it on one second of silence. Raises on any failure.
+    """
+    import torch
+
+    waveform = torch.zeros(1, 1, 16_000)
+    for name in names:
+        model = load_pyannote_model(name)
+        with torch.inference_mode():
+            model(waveform)
+        print(f"[MODEL STORE] {name} OK")
+
+
+def main():
+    from dotenv import load_dotenv
+
+    load_dotenv()
+
+    parser = argparse.ArgumentParser(description="Store local des modèles")
+    parser.add_argument("command", choices=["prepare", "check"])
+    args = parser.parse_args()
+
+    if args.command == "prepare":
+        prepare(hf_token=os.getenv("HF_TOKEN"))
+    else:
+        check()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,7 @@
 """
 Patch a line in lightning_fabric.utilities.cloud_io._load as it crashes WhisperX (seems to not be OS related)
 Needs to be loaded before importing package "whisperx"
+Only used when the local model store (web/model_store.py) is not prepared
 """
 
 # patch_lightning.py
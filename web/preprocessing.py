@@ -4,6 +4,8 @@ import audiofile
 import numpy as np
 from rVADfast import rVADfast
 
+from web import profiling
+
 
 def normalize_audio(signal: np.ndarray) -> np.ndarray:
     max_val = np.max(np.abs(signal))
@@ -14,50 +16,68 @@ def normalize_audio(signal: np.ndarray) -> np.ndarray:
 
 def preprocess_audio(
     *, file_path: str, mono: bool = True, target_sr: int = 16_000
-) -> bool:
+) -> dict:
     """
     Apply rVADfast to an audio file and overwrite it with speech-only audio.
     Falls back to original audio if no speech is detected.
 
     Returns
     -------
-    bool
-        True if VAD speech was used, False if fallback occurred.
+    dict
+        vad_applied: True if VAD speech was used, False if fallback occurred.
+        duration: duration of the original audio, in seconds.
+        speech_seconds: duration of the detected speech, in seconds.
+        speech_ratio: speech_seconds / duration (1.0 if VAD failed).
+        waveform: normalized 16 kHz signal before VAD (for fingerprinting).
     """
 
     if not os.path.isfile(file_path):
         raise FileNotFoundError(file_path)
 
     # ======== LOAD AUDIO ========
-    waveform, sampling_rate = audiofile.read(file_path)
+    with profiling.stage("decode"):
+        waveform, sampling_rate = audiofile.read(file_path)
 
-    # Force mono
-    if mono and waveform.ndim > 1:
-        waveform = waveform.mean(axis=0)
+        # Force mono
+        if mono and waveform.ndim > 1:
+            waveform = waveform.mean(axis=0)
 
-    waveform = waveform.astype(np.float32)
+        waveform = waveform.astype(np.float32)
 
-    # Resample if needed
-    if target_sr is not None and sampling_rate != target_sr:
-        import librosa
+        # Resample if needed
+        if target_sr is not None and sampling_rate != target_sr:
+            import librosa
 
-        waveform = librosa.resample(
-            waveform, orig_sr=sampling_rate, target_sr=target_sr
-        )
-        sampling_rate = target_sr
+            waveform = librosa.resample(
+                waveform, orig_sr=sampling_rate, target_sr=target_sr
+            )
+            sampling_rate = target_sr
 
     # Normalize BEFORE VAD
     waveform = normalize_audio(waveform)
 
+    duration = len(waveform) / sampling_rate
+    stats = {
+        "vad_applied": False,
+        "duration": duration,
+        "speech_seconds": 0.0,
+        "speech_ratio": 0.0,
+        "waveform": waveform,
+    }
+
     # ======== INIT VAD ========
     vad = rVADfast()
 
     try:
-        vad_labels, vad_timestamps = vad(waveform, sampling_rate)
+        with profiling.stage("rvad"):
+            vad_labels, vad_timestamps = vad(waveform, sampling_rate)
     except Exception as e:
         print(f"[VAD WARNING] rVAD failed ({e}), keeping original audio.")
         audiofile.write(file_path, waveform, sampling_rate)
-        return False
+        # Ratio inconnu : on ne laisse pas le triage écarter l'appel
+        stats["speech_seconds"] = duration
+        stats["speech_ratio"] = 1.0
+        return stats
 
     # ======== COLLECT SPEECH SEGMENTS ========
     speech_segments = []
@@ -83,7 +103,7 @@ def preprocess_audio(
     if not speech_segments:
         print(f"[VAD INFO] No speech detected in {file_path}, keeping original audio.")
         audiofile.write(file_path, waveform, sampling_rate)
-        return False
+        return stats
 
     # ======== CONCAT & NORMALIZE ========
     speech_audio = np.concatenate(speech_segments)
@@ -91,4 +111,8 @@ def preprocess_audio(
 
     # ======== OVERWRITE FILE ========
     audiofile.write(file_path, speech_audio, sampling_rate)
-    return True
+
+    stats["vad_applied"] = True
+    stats["speech_seconds"] = len(speech_audio) / sampling_rate
+    stats["speech_ratio"] = stats["speech_seconds"] / duration if duration else 0.0
+    return stats
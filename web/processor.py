@@ -1,24 +1,239 @@
-import argparse
 import io
 import json
 import os
 import re
-import shutil
+import struct
 import tempfile
+import time
 import uuid
 import wave
 
 import ollama
 import torch
+import whisperx
 from dotenv import load_dotenv
-from whisperx.transcribe import transcribe_task
-
+from faster_whisper import WhisperModel
+
+from web import (
+    admission,
+    cpu_parallel,
+    fingerprint,
+    model_store,
+    profiling,
+    triage,
+)
+from web.diarization import (
+    assign_segment_speakers,
+    diarize,
+    format_transcript,
+    load_diarization_pipeline,
+    move_diarization_pipeline,
+    speaker_turn_chunks,
+    turn_chunks_enabled,
+    turns_to_arrays,
+)
 from web.preprocessing import preprocess_audio
-from web.summarize import summarize
+from web.residency import ModelResidencyManager
+from web.summarize import LLM_MODEL, summarize
+from web.voiceprints import get_store, identify_operator
 
 # Charger les variables d'environnement depuis le fichier .env
 load_dotenv()
 
+DEVICE = "cuda" if torch.cuda.is_available() else "cpu"
+
+# ASR
+WHISPER_MODEL = "large-v2"
+# Modèles du triage : sonde rapide et route "light"
+TRIAGE_MODEL = os.getenv("TRIAGE_MODEL", "tiny")
+LIGHT_MODEL = os.getenv("TRIAGE_LIGHT_MODEL", "small")
+if model_store.is_prepared():
+    # Échec au démarrage plutôt qu'au premier appel routé vers ces modèles
+    model_store.check_whisper_sizes([WHISPER_MODEL, TRIAGE_MODEL, LIGHT_MODEL])
+COMPUTE_TYPE = "int8"
+BATCH_SIZE = 8
+LANGUAGE = "fr"
+SAMPLE_RATE = 16_000
+VAD_OPTIONS = {"vad_onset": 0.5, "vad_offset": 0.363, "chunk_size": 30}
+ASR_OPTIONS = {
+    "beam_size": 5,
+    "best_of": 5,
+    "patience": 1.0,
+    "length_penalty": 1.0,
+    "temperatures": [0.0, 0.2, 0.4, 0.6, 0.8, 1.0],
+    "compression_ratio_threshold": 2.4,
+    "log_prob_threshold": -1.0,
+    "no_speech_threshold": 0.6,
+    "condition_on_previous_text": False,
+    "initial_prompt": None,
+    "suppress_tokens": [-1],
+    "suppress_numerals": False,
+}
+
+
+# ======== MODÈLES RÉSIDENTS ========
+
+
+def _whisper_source(size: str) -> str:
+    """Local store directory of a Whisper model, or its hub name."""
+    if model_store.is_prepared():
+        return model_store.whisper_path(size)
+    return size
+
+
+def _load_whisper(size: str = WHISPER_MODEL):
+    if model_store.is_prepared():
+        # Modèles locaux : aucun accès au hub, VAD sans torch.load pickle
+        return whisperx.load_model(
+            _whisper_source(size),
+            DEVICE,
+            device_index=0,
+            compute_type=COMPUTE_TYPE,
+            asr_options=ASR_OPTIONS,
+            language=LANGUAGE,
+            vad_model=model_store.load_vad_pipeline(
+                DEVICE,
+                onset=VAD_OPTIONS["vad_onset"],
+                offset=VAD_OPTIONS["vad_offset"],
+            ),
+            vad_options=VAD_OPTIONS,
+            task="transcribe",
+            local_files_only=True,
+        )
+    return whisperx.load_model(
+        size,
+        DEVICE,
+        device_index=0,
+        compute_type=COMPUTE_TYPE,
+        asr_options=ASR_OPTIONS,
+        language=LANGUAGE,
+        vad_method="pyannote",
+        vad_options=VAD_OPTIONS,
+        task="transcribe",
+    )
+
+
+def _name_asr_batches(pipeline):
+    """Wrap the batched decoding step in a profiling range per batch."""
+    forward = pipeline.forward
+
+    def profiled_forward(*args, **kwargs):
+        with profiling.stage("asr_batch"):
+            return forward(*args, **kwargs)
+
+    pipeline.forward = profiled_forward
+    return pipeline
+
+
+def _load_probe_model():
+    return WhisperModel(
+        _whisper_source(TRIAGE_MODEL), device=DEVICE, compute_type=COMPUTE_TYPE
+    )
+
+
+def _move_ctranslate2(whisper_model, device: str):
+    # CTranslate2 sait décharger ses poids en RAM et les recharger sur GPU
+    if device == "cpu":
+        whisper_model.model.unload_model(to_cpu=True)
+    else:
+        whisper_model.model.load_model()
+    return whisper_model
+
+
+def _move_whisper(pipeline, device: str):
+    _move_ctranslate2(pipeline.model, device)
+    # VAD pyannote de WhisperX : wrapper Pyannote (hub) ou pipeline (store local)
+    vad_pipeline = getattr(pipeline.vad_model, "vad_pipeline", pipeline.vad_model)
+    vad_pipeline.to(torch.device(device))
+    return pipeline
+
+
+def _load_alignment():
+    model_dir = model_store.alignment_dir() if model_store.is_prepared() else None
+    return whisperx.load_align_model(
+        language_code=LANGUAGE, device=DEVICE, model_dir=model_dir
+    )
+
+
+def _load_diarization():
+    if model_store.is_prepared():
+        return model_store.load_diarization_pipeline(DEVICE)
+    return load_diarization_pipeline(device=DEVICE, hf_token=os.getenv("HF_TOKEN"))
+
+
+def _move_alignment(model_and_metadata, device: str):
+    align_model, align_metadata = model_and_metadata
+    return align_model.to(device), align_metadata
+
+
+models = ModelResidencyManager.from_env(device=DEVICE)
+models.register(
+    "whisper",
+    loader=lambda: _name_asr_batches(_load_whisper()),
+    to_gpu=lambda obj: _move_whisper(obj, DEVICE),
+    to_cpu=lambda obj: _move_whisper(obj, "cpu"),
+)
+models.register(
+    "whisper_light",
+    loader=lambda: _name_asr_batches(_load_whisper(LIGHT_MODEL)),
+    to_gpu=lambda obj: _move_whisper(obj, DEVICE),
+    to_cpu=lambda obj: _move_whisper(obj, "cpu"),
+)
+models.register(
+    "whisper_probe",
+    loader=_load_probe_model,
+    to_gpu=lambda obj: _move_ctranslate2(obj, DEVICE),
+    to_cpu=lambda obj: _move_ctranslate2(obj, "cpu"),
+)
+models.register(
+    "alignment",
+    loader=_load_alignment,
+    to_gpu=lambda obj: _move_alignment(obj, DEVICE),
+    to_cpu=lambda obj: _move_alignment(obj, "cpu"),
+)
+models.register(
+    "diarization",
+    loader=_load_diarization,
+    to_gpu=lambda obj: move_diarization_pipeline(obj, DEVICE),
+    to_cpu=lambda obj: move_diarization_pipeline(obj, "cpu"),
+)
+models.register_ollama(model=LLM_MODEL)
+
+
+def get_wav_duration(audio_data) -> float | None:
+    """
+    Read the duration of WAV audio data from its RIFF header only.
+    Works for every WAV encoding (PCM, float, extensible), unlike `wave`.
+    Returns None if the header cannot be parsed.
+    """
+    if len(audio_data) < 12:
+        return None
+    if audio_data[:4] != b"RIFF" or audio_data[8:12] != b"WAVE":
+        return None
+
+    byte_rate = None
+    offset = 12
+    while offset + 8 <= len(audio_data):
+        chunk_id = audio_data[offset : offset + 4]
+        (chunk_size,) = struct.unpack("<I", audio_data[offset + 4 : offset + 8])
+        body = offset + 8
+
+        if chunk_id == b"fmt " and chunk_size >= 12:
+            if body + 12 > len(audio_data):
+                return None
+            (byte_rate,) = struct.unpack("<I", audio_data[body + 8 : body + 12])
+        elif chunk_id == b"data":
+            if not byte_rate:
+                return None
+            # Taille bornée par les données réellement reçues (en-têtes streamés)
+            data_size = min(chunk_size, len(audio_data) - body)
+            return data_size / byte_rate
+
+        # Les chunks sont alignés sur 2 octets
+        offset = body + chunk_size + (chunk_size & 1)
+
+    return None
+
 
 def get_wav_metadata(*, audio_data, filename):
     """
@@ -82,127 +297,241 @@ def save_audio_to_temp(audio_data):
     return temp_filepath
 
 
-def rename_speakers(*, text: str, first_speaker: str) -> str:
-    SPEAKERS_MAPPING = {
+def speakers_mapping(*, first_speaker: str, operator: dict | None = None) -> dict:
+    """
+    Map diarization labels to roles. An operator identified from the
+    voiceprint cache takes precedence over the `first_speaker` choice.
+    """
+    if operator is not None:
+        return {
+            label: "Opérateur MAIF" if label == operator["speaker"] else "Sociétaire"
+            for label in ("SPEAKER_00", "SPEAKER_01")
+        }
+    return {
         "SPEAKER_00": "Opérateur MAIF" if first_speaker == "maif" else "Sociétaire",
         "SPEAKER_01": "Sociétaire" if first_speaker == "maif" else "Opérateur MAIF",
     }
 
-    for original_speaker, speaker_replacement in SPEAKERS_MAPPING.items():
-        text = text.replace(original_speaker, speaker_replacement)
-
-    return text
-
-
-def call_transcribe_task(
-    audio_filepath: str,
-    output_dir: str,
-):
-    args = {
-        "audio": [audio_filepath],
-        # model / runtime
-        "model": "large-v2",
-        "model_cache_only": False,
-        "model_dir": None,
-        "device": "cuda" if torch.cuda.is_available() else "cpu",
-        "device_index": 0,
-        "batch_size": 8,
-        "compute_type": "int8",
-        # output / logging
-        "output_dir": output_dir,
-        "output_format": "all",
-        "verbose": True,
-        "log_level": None,
-        # task / language
-        "task": "transcribe",
-        "language": "fr",
-        # alignment
-        "align_model": None,
-        "interpolate_method": "nearest",
-        "no_align": False,
-        "return_char_alignments": False,
-        # VAD
-        "vad_method": "pyannote",
-        "vad_onset": 0.5,
-        "vad_offset": 0.363,
-        "chunk_size": 30,
-        # diarization
-        "diarize": True,
-        "min_speakers": 2,
-        "max_speakers": 2,
-        "diarize_model": "pyannote/speaker-diarization-3.1",
-        "speaker_embeddings": False,
-        # decoding
-        "temperature": 0.0,
-        "best_of": 5,
-        "beam_size": 5,
-        "patience": 1.0,
-        "length_penalty": 1.0,
-        "suppress_tokens": "-1",
-        "suppress_numerals": False,
-        # prompts / fp16
-        "initial_prompt": None,
-        "condition_on_previous_text": False,
-        "fp16": True,
-        # fallback
-        "temperature_increment_on_fallback": 0.2,
-        "compression_ratio_threshold": 2.4,
-        "logprob_threshold": -1.0,
-        "no_speech_threshold": 0.6,
-        # formatting
-        "max_line_width": None,
-        "max_line_count": None,
-        "highlight_words": False,
-        "segment_resolution": "sentence",
-        # performance
-        "threads": 0,
-        # auth
-        "hf_token": os.getenv("HF_TOKEN"),
-        "print_progress": False,
-    }
 
-    parser = argparse.ArgumentParser()
+def rename_segment_speakers(*, segments: list[dict], mapping: dict) -> None:
+    for segment in segments:
+        for item in [segment, *segment.get("words", [])]:
+            if item.get("speaker") in mapping:
+                item["speaker"] = mapping[item["speaker"]]
 
-    transcribe_task(args, parser)
+
+def pipeline_stages(*, word_timestamps: bool = False) -> list[str]:
+    """
+    Stages run by `process_wav` on the full route, used to estimate the cost
+    of a call (triage cannot be known before the call has been analysed).
+    """
+    stages = ["preprocess"]
+    if fingerprint.enabled():
+        stages.append("fingerprint")
+    if triage.enabled():
+        stages.append("triage")
+    stages.append("asr")
+    if word_timestamps:
+        stages.append("alignment")
+    return [*stages, "diarization", "sentiment", "summary"]
+
+
+def transcribe_segments(
+    audio,
+    *,
+    audio_seconds: float | None = None,
+    light: bool = False,
+    chunks: list[dict] | None = None,
+) -> dict:
+    """
+    Run the WhisperX ASR (VAD + batched decoding) on a 16 kHz waveform.
+    On CPU-only nodes, chunks are decoded in parallel by a process pool.
+    With `light`, the small model of the triage "light" route is used; it is
+    timed as its own stage so that it does not lower the full-route ASR RTF
+    used by admission control.
+    `chunks` ({"start", "end"} in seconds, e.g. the speaker turns) replace
+    the VAD chunks.
+    """
+    started = time.perf_counter()
+    if cpu_parallel.enabled(DEVICE) and not light:
+        sample_ranges = None
+        if chunks is not None:
+            sample_ranges = [
+                (int(c["start"] * SAMPLE_RATE), int(c["end"] * SAMPLE_RATE))
+                for c in chunks
+            ]
+        with profiling.stage("asr"):
+            result = cpu_parallel.transcribe(
+                audio,
+                model_name=_whisper_source(WHISPER_MODEL),
+                compute_type=COMPUTE_TYPE,
+                language=LANGUAGE,
+                asr_options=ASR_OPTIONS,
+                vad_options=VAD_OPTIONS,
+                chunks=sample_ranges,
+            )
+        record_stage(stage="asr", audio_seconds=audio_seconds, started=started)
+        return result
+
+    stage = "asr_light" if light else "asr"
+    model_name = "whisper_light" if light else "whisper"
+    with profiling.stage(stage), models.use(model_name) as model:
+        if chunks is None:
+            result = model.transcribe(
+                audio,
+                batch_size=BATCH_SIZE,
+                chunk_size=VAD_OPTIONS["chunk_size"],
+                print_progress=False,
+            )
+        else:
+            result = _decode_chunks(model, audio, chunks)
+    record_stage(stage=stage, audio_seconds=audio_seconds, started=started)
+    return result
 
 
-def transcribe_with_whisperx(audio_filepath: str, first_speaker="maif"):
-    # Create a temp directory for whisperx output
-    output_dir = tempfile.mkdtemp()
+def _decode_chunks(pipeline, audio, chunks: list[dict]) -> dict:
+    """
+    Batched decoding of given chunks with the WhisperX pipeline, as its
+    `transcribe` does for the VAD chunks (one segment per chunk).
+    """
 
+    def inputs():
+        for chunk in chunks:
+            start = int(chunk["start"] * SAMPLE_RATE)
+            yield {"inputs": audio[start : int(chunk["end"] * SAMPLE_RATE)]}
+
+    segments = []
+    outputs = pipeline(inputs(), batch_size=BATCH_SIZE, num_workers=0)
+    for chunk, out in zip(chunks, outputs):
+        segments.append(
+            {
+                "text": out["text"],
+                "start": round(chunk["start"], 3),
+                "end": round(chunk["end"], 3),
+            }
+        )
+    return {"segments": segments, "language": LANGUAGE}
+
+
+def align_words(audio, result: dict, *, audio_seconds: float | None = None) -> dict:
+    """Forced alignment with wav2vec2, only needed for word timings."""
+    started = time.perf_counter()
+    with (
+        profiling.stage("alignment"),
+        models.use("alignment") as (align_model, align_metadata),
+    ):
+        aligned = whisperx.align(
+            result["segments"],
+            align_model,
+            align_metadata,
+            audio,
+            DEVICE,
+            interpolate_method="nearest",
+            return_char_alignments=False,
+        )
+    record_stage(stage="alignment", audio_seconds=audio_seconds, started=started)
+    return aligned
+
+
+def run_diarization(audio, *, audio_seconds: float | None = None):
+    """Pyannote diarization: (turns DataFrame, speaker centroid embeddings)."""
+    started = time.perf_counter()
+    with (
+        profiling.stage("diarization"),
+        models.use("diarization") as diarize_model,
+    ):
+        diarize_df, speaker_embeddings = diarize(diarize_model, audio)
+    record_stage(stage="diarization", audio_seconds=audio_seconds, started=started)
+    return diarize_df, speaker_embeddings
+
+
+def transcribe_with_whisperx(
+    audio,
+    first_speaker="maif",
+    *,
+    word_timestamps: bool = False,
+    audio_seconds: float | None = None,
+    light: bool = False,
+) -> dict | None:
+    """
+    Transcribe and diarize a 16 kHz waveform.
+    Without word timings, speakers are assigned per segment from the
+    diarization turns and the alignment model is never loaded.
+    With ASR_TURN_CHUNKS (default), diarization runs first and the ASR
+    chunks are cut at its turns, so that no segment spans two speakers;
+    otherwise ASR decodes VAD chunks of up to 30 s.
+
+    Returns {"transcript": str, "segments": list | None, "operator": dict | None},
+    or None on error. `segments` (with word timings) is only filled when
+    `word_timestamps`; `operator` is the voiceprint match, if any.
+    """
     try:
-        try:
-            # Run whisperx via CLI
-            call_transcribe_task(audio_filepath=audio_filepath, output_dir=output_dir)
-        except Exception as e:
-            print(f"Error WhisperX: {e}")
-            return None
-
-        # Read the output txt file
-        audio_basename = os.path.splitext(os.path.basename(audio_filepath))[0]
-        txt_output_path = os.path.join(output_dir, f"{audio_basename}.txt")
-
-        if os.path.exists(txt_output_path):
-            with open(txt_output_path, "r", encoding="utf-8") as f:
-                transcript = f.read().strip()
-                transcript = rename_speakers(
-                    text=transcript, first_speaker=first_speaker
-                )
-            with open(txt_output_path, "w", encoding="utf-8") as f:
-                f.write(transcript)
-            print(f"Transcript: {transcript}")
-            return transcript
+        if turn_chunks_enabled():
+            # Diarisation d'abord : un chunk ASR ne chevauche pas deux locuteurs
+            diarize_df, speaker_embeddings = run_diarization(
+                audio, audio_seconds=audio_seconds
+            )
+            chunks = speaker_turn_chunks(
+                *turns_to_arrays(diarize_df), chunk_size=VAD_OPTIONS["chunk_size"]
+            )
+            # Sans tour détecté, repli sur les chunks VAD
+            result = transcribe_segments(
+                audio, audio_seconds=audio_seconds, light=light, chunks=chunks or None
+            )
+            if word_timestamps:
+                result = align_words(audio, result, audio_seconds=audio_seconds)
         else:
-            print(f"Output file not found: {txt_output_path}")
-            return None
-
-    finally:
-        # Clean up temp output directory
-        shutil.rmtree(output_dir, ignore_errors=True)
+            # ASR et diarisation indépendantes : le modèle déjà sur GPU d'abord
+            for stage in models.order_stages(["asr", "diarization"]):
+                if stage == "asr":
+                    result = transcribe_segments(
+                        audio, audio_seconds=audio_seconds, light=light
+                    )
+                    if word_timestamps:
+                        result = align_words(audio, result, audio_seconds=audio_seconds)
+                else:
+                    diarize_df, speaker_embeddings = run_diarization(
+                        audio, audio_seconds=audio_seconds
+                    )
+
+        if word_timestamps:
+            result = whisperx.assign_word_speakers(diarize_df, result)
+        else:
+            turn_starts, turn_ends, turn_speakers = turns_to_arrays(diarize_df)
+            assign_segment_speakers(
+                result["segments"],
+                turn_starts=turn_starts,
+                turn_ends=turn_ends,
+                turn_speakers=turn_speakers,
+            )
+    except Exception as e:
+        print(f"Error WhisperX: {e}")
+        return None
+
+    segments = result["segments"]
+    if not segments:
+        print("No segment transcribed")
+        return None
+
+    operator = identify_operator(speaker_embeddings)
+    if operator is not None:
+        print(f"Operator identified: {operator}")
+    rename_segment_speakers(
+        segments=segments,
+        mapping=speakers_mapping(first_speaker=first_speaker, operator=operator),
+    )
+    transcript = format_transcript(segments)
+    print(f"Transcript: {transcript}")
+
+    return {
+        "transcript": transcript,
+        "segments": segments if word_timestamps else None,
+        "operator": operator,
+    }
 
 
 def analyse_satisfaction_text(
-    *, transcription: str, llm_model_name: str = "llama3"
+    *, transcription: str, llm_model_name: str = LLM_MODEL, keep_alive=None
 ) -> dict:
     REGEX_BRACKETS = re.compile(r"\[.*?\]:\s*", re.IGNORECASE)
     transcription = REGEX_BRACKETS.sub(transcription, "")
@@ -222,44 +551,213 @@ def analyse_satisfaction_text(
 
     print("Starting sentiment analysis call")
 
-    res = ollama.generate(model=llm_model_name, prompt=prompt)
+    res = ollama.generate(model=llm_model_name, prompt=prompt, keep_alive=keep_alive)
 
     print("Sentiment analysis call completed")
     return json.loads(res["response"])
 
 
-def process_wav(audio_data, first_speaker="maif"):
+def record_stage(*, stage: str, audio_seconds: float | None, started: float) -> None:
+    """Feed the measured duration of a stage to the admission controller."""
+    admission.controller.record_stage(
+        device=DEVICE,
+        stage=stage,
+        audio_seconds=audio_seconds,
+        elapsed=time.perf_counter() - started,
+    )
+
+
+def run_llm_analyses(*, transcript: str, audio_seconds: float | None):
+    """Sentiment analysis and summary; returns (sentiments, summary)."""
+    # Les deux appels LLM s'enchaînent pour ne charger llama3 qu'une fois
+    with models.use("llm"):
+        started = time.perf_counter()
+        with profiling.stage("ollama_sentiment"):
+            sentiments = analyse_satisfaction_text(
+                transcription=transcript, keep_alive=models.ollama_keep_alive()
+            )
+        record_stage(stage="sentiment", audio_seconds=audio_seconds, started=started)
+
+        started = time.perf_counter()
+        with profiling.stage("ollama_summary"):
+            summary = summarize(
+                transcript=transcript, keep_alive=models.ollama_keep_alive()
+            )
+        record_stage(stage="summary", audio_seconds=audio_seconds, started=started)
+    return sentiments, summary
+
+
+def run_triage(audio, *, stats: dict, audio_seconds: float | None) -> dict:
+    """
+    Route the call to "skip", "light" or "full" processing (see web/triage.py).
+    The tiny-model probe only runs when there is enough speech to look at.
+    """
+    if not triage.enabled():
+        return {"route": triage.FULL, "reason": "Triage désactivé"}
+
+    started = time.perf_counter()
+    probe_text = None
+    with profiling.stage("triage"):
+        if triage.has_enough_speech(stats):
+            with models.use("whisper_probe") as probe_model:
+                probe_text = triage.probe_transcript(
+                    probe_model,
+                    audio,
+                    probe_seconds=triage.thresholds()["probe_seconds"],
+                )
+        decision = triage.decide(stats=stats, probe_text=probe_text)
+    record_stage(stage="triage", audio_seconds=audio_seconds, started=started)
+    print(f"[TRIAGE] {decision['route']} ({decision['reason']})")
+    return decision
+
+
+def find_duplicate(waveform, *, audio_seconds: float | None):
+    """
+    Fingerprint the call and look for a near-duplicate already analysed.
+    Returns (hashes, offsets, match); `match` is None when the call is new.
+    """
+    started = time.perf_counter()
+    with profiling.stage("fingerprint"):
+        hashes, offsets = fingerprint.fingerprint(waveform)
+        match = fingerprint.find_duplicate(hashes, offsets)
+    record_stage(stage="fingerprint", audio_seconds=audio_seconds, started=started)
+    if match is not None:
+        kind = "Near-duplicate" if match["same"] else "Partial match"
+        print(f"[FINGERPRINT] {kind} of {match['id']} ({match['score']})")
+    return hashes, offsets, match
+
+
+def process_wav(audio_data, first_speaker="maif", word_timestamps=False, profile=False):
+    """
+    Run the whole pipeline on WAV bytes and return the analysis.
+    With `profile` (or when sampled by PROFILE_SAMPLE_RATE), the job is traced
+    and `result["profile"]` gives the download URLs of the traces; only an
+    explicit `profile` request records torch ops.
+    """
+    with profiling.profile_job(
+        enabled=profiling.should_profile(profile), torch_ops=profile
+    ) as job:
+        result = _process_wav(
+            audio_data, first_speaker=first_speaker, word_timestamps=word_timestamps
+        )
+    if job is not None:
+        result["profile"] = job.urls
+    return result
+
+
+def _process_wav(audio_data, *, first_speaker, word_timestamps):
+    audio_seconds = get_wav_duration(audio_data)
+
     # Save to temp file with UUID
     temp_audio_path = save_audio_to_temp(audio_data)
 
-    preprocess_audio(file_path=temp_audio_path)
-
     # Get real metadata from the WAV file
     metadata = get_wav_metadata(audio_data=audio_data, filename=temp_audio_path)
 
-    try:
-        print("Starting transcription with whisperx")
-        # Transcribe with whisperx
-        transcript = transcribe_with_whisperx(
-            temp_audio_path, first_speaker=first_speaker
-        )
+    options = {"first_speaker": first_speaker, "word_timestamps": word_timestamps}
 
-        if transcript is None:
+    try:
+        started = time.perf_counter()
+        speech_stats = preprocess_audio(file_path=temp_audio_path)
+        record_stage(stage="preprocess", audio_seconds=audio_seconds, started=started)
+
+        # Même conversation déjà analysée (copie transcodée, tronquée...)
+        match = None
+        if fingerprint.enabled():
+            hashes, offsets, match = find_duplicate(
+                speech_stats["waveform"], audio_seconds=audio_seconds
+            )
+            # Seule une copie de la même conversation réutilise le résultat
+            reusable = match is not None and match["same"]
+            stored = fingerprint.get_index().get(match["id"]) if reusable else None
+            if stored is not None and stored["options"] == options:
+                return {**stored["result"], "metadata": metadata, "duplicate_of": match}
+
+        with profiling.stage("decode"):
+            audio = whisperx.load_audio(temp_audio_path)
+
+        decision = run_triage(audio, stats=speech_stats, audio_seconds=audio_seconds)
+        if decision["route"] == triage.SKIP:
+            # Rien à transcrire ni à résumer
+            transcription = {"transcript": "", "segments": [], "operator": None}
+        else:
+            print("Starting transcription with whisperx")
+            # Transcribe with whisperx
+            transcription = transcribe_with_whisperx(
+                audio,
+                first_speaker=first_speaker,
+                word_timestamps=word_timestamps,
+                audio_seconds=audio_seconds,
+                light=decision["route"] == triage.LIGHT,
+            )
+
+        if transcription is None:
             transcript = "Erreur lors de la transcription"
+            segments = operator = None
+        else:
+            transcript = transcription["transcript"]
+            segments = transcription["segments"]
+            operator = transcription["operator"]
 
         print(f"Transcription finale: {transcript}")
 
-        sentiments = analyse_satisfaction_text(transcription=transcript)
-        summary = summarize(transcript=transcript)
+        if decision["route"] == triage.FULL:
+            sentiments, summary = run_llm_analyses(
+                transcript=transcript, audio_seconds=audio_seconds
+            )
+        else:
+            # Appel écarté, ou court sans sujet métier : pas de génération LLM
+            sentiments = summary = None
 
         # Return placeholder response to frontend
-        return {
+        result = {
             "transcript": transcript,
             "emotions": sentiments,
             "summary": summary,
             "metadata": metadata,
+            "operator": operator,
+            "triage": decision,
         }
+        if word_timestamps:
+            result["segments"] = segments
+        if match is not None:
+            # Extrait commun ou options différentes : retraité, mais relié
+            result["duplicate_of"] = match
+
+        if fingerprint.enabled() and transcription is not None:
+            fingerprint.get_index().add(
+                hashes,
+                offsets,
+                options=options,
+                result=result,
+                duplicate_of=match["id"] if match else None,
+            )
+        return result
     finally:
         # Clean up temp audio file
         if os.path.exists(temp_audio_path):
             os.remove(temp_audio_path)
+
+
+def enroll_operator(audio_data, *, operator_id: str) -> int:
+    """
+    Enroll a voiceprint from a recording of the operator speaking alone.
+    The embedding is the diarization centroid of that single speaker, so it
+    lives in the same space as the clusters matched after each call.
+    Returns the number of samples enrolled for this operator.
+    """
+    temp_audio_path = save_audio_to_temp(audio_data)
+    try:
+        preprocess_audio(file_path=temp_audio_path)
+        audio = whisperx.load_audio(temp_audio_path)
+        with models.use("diarization") as diarize_model:
+            _, speaker_embeddings = diarize(
+                diarize_model, audio, min_speakers=1, max_speakers=1
+            )
+        if not speaker_embeddings:
+            raise ValueError("Aucune voix détectée dans l'enregistrement")
+        embedding = next(iter(speaker_embeddings.values()))
+        return get_store().enroll(operator_id=operator_id, embedding=embedding)
+    finally:
+        if os.path.exists(temp_audio_path):
+            os.remove(temp_audio_path)
@@ -0,0 +1,301 @@
+"""
+On-demand per-job profiling.
+
+A profiled job runs under a sampling Python profiler that inspects the job's
+thread at a fixed interval, and its pipeline stages are recorded as ranges.
+Two files are written in PROFILE_DIR/<profile id>/: `trace.json` (Chrome
+trace, open in chrome://tracing or Perfetto) and `speedscope.json`
+(https://www.speedscope.app).
+
+Pipeline stages are marked with `stage(name)`: a range in the Chrome trace
+and a root frame in the speedscope profile. Outside of a profiled job `stage`
+does nothing, so the markers cost nothing in production.
+
+Jobs sampled by PROFILE_SAMPLE_RATE only record the stage ranges and sample
+stacks every PROFILE_SAMPLE_INTERVAL_MS, which is cheap enough to leave on.
+A job profiled on request also runs under the torch profiler (CPU ops, plus
+CUDA when available), whose trace replaces the ranges-only one; it costs
+much more and is meant for occasional debugging. Profiles older than
+PROFILE_RETENTION_DAYS, or beyond PROFILE_MAX_MB in total, are deleted.
+"""
+
+import json
+import os
+import random
+import shutil
+import sys
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Échantillonnage des piles d'un job profilé à la demande
+DETAILED_SAMPLE_INTERVAL = 0.005
+
+_local = threading.local()
+# Le profiler torch est global au processus : un seul job profilé à la fois
+_profile_lock = threading.Lock()
+
+
+def profile_dir() -> str:
+    """
+    Trace directory. In fleet mode it defaults to the shared storage of the
+    job queue, so that the web tier can serve traces written by workers.
+    """
+    queue_db = os.getenv("JOB_QUEUE_DB")
+    if queue_db:
+        default = os.path.join(os.path.dirname(os.path.abspath(queue_db)), "profiles")
+    else:
+        default = os.path.join(BASE_DIR, "data", "profiles")
+    return os.getenv("PROFILE_DIR", default)
+
+
+def sample_interval() -> float:
+    """Stack sampling interval of the jobs sampled in production."""
+    return float(os.getenv("PROFILE_SAMPLE_INTERVAL_MS", "50")) / 1000
+
+
+def retention_seconds() -> float:
+    return float(os.getenv("PROFILE_RETENTION_DAYS", "7")) * 86_400
+
+
+def max_bytes() -> float:
+    return float(os.getenv("PROFILE_MAX_MB", "1024")) * 1024**2
+
+
+def should_profile(requested: bool = False) -> bool:
+    """Profile on request, or for a PROFILE_SAMPLE_RATE share of the jobs."""
+    if requested:
+        return True
+    return random.random() < float(os.getenv("PROFILE_SAMPLE_RATE", "0"))
+
+
+@contextmanager
+def stage(name: str):
+    """Named range for the current job, if it is profiled."""
+    profiler = getattr(_local, "profiler", None)
+    if profiler is None:
+        yield
+        return
+
+    profiler.stages.append(name)
+    started = time.perf_counter()
+    try:
+        if profiler.torch_ops:
+            from torch.profiler import record_function
+
+            with record_function(name):
+                yield
+        else:
+            yield
+    finally:
+        profiler.stages.pop()
+        profiler.ranges.append((name, started, time.perf_counter()))
+
+
+class _Sampler(threading.Thread):
+    """Sample the Python stack of one thread at a fixed interval."""
+
+    def __init__(self, *, thread_id: int, stages: list, interval: float):
+        super().__init__(daemon=True)
+        self.thread_id = thread_id
+        self.stages = stages
+        self.interval = interval
+        self.samples = []
+        self.started = time.perf_counter()
+        self._stop_event = threading.Event()
+
+    def run(self):
+        last = self.started
+        while not self._stop_event.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            now = time.perf_counter()
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append((code.co_name, code.co_filename, frame.f_lineno))
+                frame = frame.f_back
+            stack.reverse()
+            self.samples.append((tuple(self.stages), tuple(stack), now - last))
+            last = now
+
+    def stop(self) -> float:
+        self._stop_event.set()
+        self.join()
+        return time.perf_counter() - self.started
+
+    def to_speedscope(self, *, name: str, duration: float) -> dict:
+        frames, frame_index, samples, weights = [], {}, [], []
+
+        def index(key, frame):
+            if key not in frame_index:
+                frame_index[key] = len(frames)
+                frames.append(frame)
+            return frame_index[key]
+
+        for stages, stack, weight in self.samples:
+            sample = [index(("stage", s), {"name": f"[{s}]"}) for s in stages]
+            sample += [
+                index(
+                    (func, filename, line),
+                    {"name": func, "file": filename, "line": line},
+                )
+                for func, filename, line in stack
+            ]
+            samples.append(sample)
+            weights.append(weight)
+
+        return {
+            "$schema": "https://www.speedscope.app/file-format-schema.json",
+            "name": name,
+            "exporter": "vocalisai",
+            "shared": {"frames": frames},
+            "profiles": [
+                {
+                    "type": "sampled",
+                    "name": name,
+                    "unit": "seconds",
+                    "startValue": 0,
+                    "endValue": duration,
+                    "samples": samples,
+                    "weights": weights,
+                }
+            ],
+        }
+
+
+class JobProfile:
+    def __init__(self, profile_id: str, *, torch_ops: bool):
+        self.profile_id = profile_id
+        self.directory = os.path.join(profile_dir(), profile_id)
+        self.torch_ops = torch_ops
+        self.stages = []
+        # (nom, début, fin) de chaque étape, en secondes perf_counter
+        self.ranges = []
+
+    def path(self, name: str) -> str:
+        return os.path.join(self.directory, name)
+
+    @property
+    def urls(self) -> dict:
+        """Download URLs of the traces (`/profiles/<id>/<name>` route)."""
+        return {
+            "id": self.profile_id,
+            "chrome_trace": f"/profiles/{self.profile_id}/trace.json",
+            "speedscope": f"/profiles/{self.profile_id}/speedscope.json",
+        }
+
+    def to_chrome_trace(self, *, origin: float) -> dict:
+        """Chrome trace with one complete event per stage range."""
+        return {
+            "traceEvents": [
+                {
+                    "name": name,
+                    "ph": "X",
+                    "ts": (started - origin) * 1e6,
+                    "dur": (ended - started) * 1e6,
+                    "pid": os.getpid(),
+                    "tid": threading.get_ident(),
+                }
+                for name, started, ended in self.ranges
+            ],
+            "displayTimeUnit": "ms",
+        }
+
+
+def prune_profiles(*, keep: str | None = None) -> None:
+    """
+    Delete the profiles older than PROFILE_RETENTION_DAYS, then the oldest
+    ones until the directory fits PROFILE_MAX_MB. `keep` is never deleted.
+    """
+    root = profile_dir()
+    if not os.path.isdir(root):
+        return
+    profiles = []
+    for entry in os.scandir(root):
+        if not entry.is_dir() or entry.name == keep:
+            continue
+        files = [f for f in os.scandir(entry.path) if f.is_file()]
+        size = sum(f.stat().st_size for f in files)
+        profiles.append((entry.stat().st_mtime, size, entry.path))
+    if keep is not None:
+        kept = os.path.join(root, keep)
+        total = sum(f.stat().st_size for f in os.scandir(kept) if f.is_file())
+    else:
+        total = 0
+    total += sum(size for _, size, _ in profiles)
+
+    cutoff = time.time() - retention_seconds()
+    for mtime, size, path in sorted(profiles):
+        if mtime >= cutoff and total <= max_bytes():
+            break
+        shutil.rmtree(path, ignore_errors=True)
+        total -= size
+
+
+@contextmanager
+def profile_job(*, enabled: bool, torch_ops: bool = False, name: str = "process_wav"):
+    """
+    Profile the enclosed job when `enabled`; yields a JobProfile (whose
+    traces are written on exit) or None. `torch_ops` adds the torch profiler.
+    A job is not profiled while another one is, since both would share the
+    process-wide torch profiler and the sampler of the job thread.
+    """
+    if not enabled:
+        yield None
+        return
+    if not _profile_lock.acquire(blocking=False):
+        print("[PROFILE WARNING] Another job is being profiled, skipping")
+        yield None
+        return
+
+    try:
+        with _profiled(name, torch_ops=torch_ops) as job_profile:
+            yield job_profile
+    finally:
+        _profile_lock.release()
+
+
+@contextmanager
+def _profiled(name: str, *, torch_ops: bool):
+    job_profile = JobProfile(str(uuid.uuid4()), torch_ops=torch_ops)
+    os.makedirs(job_profile.directory, exist_ok=True)
+
+    sampler = _Sampler(
+        thread_id=threading.get_ident(),
+        stages=job_profile.stages,
+        interval=DETAILED_SAMPLE_INTERVAL if torch_ops else sample_interval(),
+    )
+    torch_profiler = None
+    if torch_ops:
+        # Import tardif : le web en mode flotte sert les traces sans torch
+        import torch
+        from torch.profiler import ProfilerActivity
+
+        activities = [ProfilerActivity.CPU]
+        if torch.cuda.is_available():
+            activities.append(ProfilerActivity.CUDA)
+        torch_profiler = torch.profiler.profile(activities=activities)
+        torch_profiler.__enter__()
+
+    _local.profiler = job_profile
+    sampler.start()
+    try:
+        yield job_profile
+    finally:
+        duration = sampler.stop()
+        _local.profiler = None
+
+        trace_path = job_profile.path("trace.json")
+        if torch_profiler is not None:
+            torch_profiler.__exit__(None, None, None)
+            torch_profiler.export_chrome_trace(trace_path)
+        else:
+            with open(trace_path, "w", encoding="utf-8") as f:
+                json.dump(job_profile.to_chrome_trace(origin=sampler.started), f)
+        with open(job_profile.path("speedscope.json"), "w", encoding="utf-8") as f:
+            json.dump(sampler.to_speedscope(name=name, duration=duration), f)
+        print(f"[PROFILE] Traces written to {job_profile.directory}")
+        prune_profiles(keep=job_profile.profile_id)
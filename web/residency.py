@@ -0,0 +1,359 @@
+"""
+GPU model residency manager.
+
+Whisper, the wav2vec2 alignment model, the pyannote diarization pipeline and
+the Ollama LLM share one GPU. Models are loaded once and kept in the process;
+the manager tracks the VRAM footprint of each one and keeps the hot set on
+the GPU within a configured budget. When a model must come in, the least
+recently used idle models are offloaded to CPU RAM (or, for Ollama, asked to
+unload with `keep_alive=0`). Swap counts and swap time are exposed as metrics.
+
+The budget is tracked per process, so a model is also brought in only when
+the device really has room for it (`torch.cuda.mem_get_info`): memory held by
+another worker on the same card or by the Ollama server makes this process
+offload its own idle models, then wait for a bounded time.
+
+On CPU-only nodes there is no budget: models are simply cached.
+"""
+
+import os
+import statistics
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+import ollama
+import torch
+
+GB = 1024**3
+
+# Empreintes VRAM a priori, remplacées par les mesures faites à chaque chargement
+DEFAULT_FOOTPRINTS_GB = {
+    "whisper": 3.0,
+    "whisper_light": 1.0,
+    "whisper_probe": 0.3,
+    "alignment": 1.3,
+    "diarization": 0.6,
+    "llm": 5.5,
+}
+
+# Modèle utilisé par chaque étape du pipeline
+STAGE_MODELS = {
+    "triage": "whisper_probe",
+    "asr": "whisper",
+    "asr_light": "whisper_light",
+    "alignment": "alignment",
+    "diarization": "diarization",
+    "sentiment": "llm",
+    "summary": "llm",
+}
+
+# Mesures d'empreinte conservées par modèle (médiane glissante)
+FOOTPRINT_SAMPLES = 5
+
+UNLOADED = "unloaded"
+ON_CPU = "cpu"
+ON_GPU = "gpu"
+
+
+class _Entry:
+    def __init__(self, *, name, loader, to_gpu, to_cpu, footprint):
+        self.name = name
+        self.loader = loader
+        self.to_gpu = to_gpu
+        self.to_cpu = to_cpu
+        self.footprint = footprint
+        # Empreinte imposée par variable d'environnement : pas de mesure
+        self.fixed = False
+        self.samples = deque(maxlen=FOOTPRINT_SAMPLES)
+        self.obj = None
+        self.state = UNLOADED
+        self.in_use = 0
+        self.last_used = 0.0
+        self.loads = 0
+        self.swaps_in = 0
+        self.swaps_out = 0
+        self.swap_seconds = 0.0
+
+
+class ModelResidencyManager:
+    def __init__(
+        self,
+        *,
+        device: str,
+        budget_bytes: float | None,
+        wait_seconds: float = 60.0,
+    ):
+        self.device = device
+        self.budget_bytes = budget_bytes
+        # Attente maximale de mémoire tenue par d'autres processus
+        self.wait_seconds = wait_seconds
+        self._entries = {}
+        self._lock = threading.RLock()
+        # Signalé à chaque libération de modèle (attente de place sur le GPU)
+        self._released = threading.Condition(self._lock)
+        self._held = threading.local()
+
+    @classmethod
+    def from_env(cls, *, device: str):
+        budget = None
+        if device.startswith("cuda") and torch.cuda.is_available():
+            budget_gb = os.getenv("GPU_MEMORY_BUDGET_GB")
+            if budget_gb:
+                budget = float(budget_gb) * GB
+            else:
+                # 90 % de la carte par défaut (contexte CUDA, fragmentation)
+                budget = 0.9 * torch.cuda.get_device_properties(0).total_memory
+        return cls(
+            device=device,
+            budget_bytes=budget,
+            wait_seconds=float(os.getenv("GPU_MEMORY_WAIT_SECONDS", "60")),
+        )
+
+    # ======== ENREGISTREMENT ========
+
+    def register(self, name: str, *, loader, to_gpu=None, to_cpu=None) -> None:
+        """
+        Declare a model. `loader()` builds it on the GPU; `to_cpu(obj)` and
+        `to_gpu(obj)` move it between devices. Without them, an evicted model
+        is dropped and rebuilt by `loader()` on next use.
+        """
+        footprint = DEFAULT_FOOTPRINTS_GB.get(name, 1.0) * GB
+        env_footprint = os.getenv(f"{name.upper()}_FOOTPRINT_GB")
+        with self._lock:
+            if name in self._entries:
+                return
+            entry = _Entry(
+                name=name,
+                loader=loader,
+                to_gpu=to_gpu,
+                to_cpu=to_cpu,
+                footprint=float(env_footprint) * GB if env_footprint else footprint,
+            )
+            entry.fixed = env_footprint is not None
+            self._entries[name] = entry
+
+    def register_ollama(self, *, model: str) -> None:
+        """Declare the Ollama model, which lives in the Ollama server."""
+
+        # Délai borné : le verrou du gestionnaire est tenu pendant l'éviction
+        client = ollama.Client(
+            timeout=float(os.getenv("OLLAMA_UNLOAD_TIMEOUT_SECONDS", "10"))
+        )
+
+        def unload(_):
+            # Un serveur Ollama lent ou arrêté ne doit pas faire échouer l'ASR :
+            # le modèle est considéré déchargé dans tous les cas
+            try:
+                client.generate(model=model, prompt="", keep_alive=0)
+            except Exception as e:
+                print(f"[RESIDENCY WARNING] Ollama unload failed for {model}: {e}")
+
+        self.register("llm", loader=lambda: model, to_cpu=unload)
+
+    # ======== UTILISATION ========
+
+    def _resident_bytes(self, exclude=None) -> float:
+        return sum(
+            entry.footprint
+            for entry in self._entries.values()
+            if entry.state == ON_GPU and entry is not exclude
+        )
+
+    def _free_gpu_bytes(self) -> float | None:
+        if self.budget_bytes is None:
+            return None
+        free, _ = torch.cuda.mem_get_info()
+        return free
+
+    def _available_gpu_bytes(self) -> float:
+        """Free device memory, plus the torch cache this process can reuse."""
+        free, _ = torch.cuda.mem_get_info()
+        return free + torch.cuda.memory_reserved() - torch.cuda.memory_allocated()
+
+    def _held_names(self) -> list:
+        if not hasattr(self._held, "names"):
+            self._held.names = []
+        return self._held.names
+
+    def _make_room(self, entry: _Entry) -> None:
+        """
+        Evict idle models until `entry` fits both the budget and the memory
+        really free on the device. When the models in the way are in use by
+        other jobs, wait until they are released rather than overcommit the
+        GPU; when the memory is held by other processes, wait at most
+        `wait_seconds` for them.
+        """
+        if self.budget_bytes is None:
+            return
+        deadline = None
+        while entry.state != ON_GPU:
+            over_budget = (
+                self._resident_bytes(exclude=entry) + entry.footprint
+                > self.budget_bytes
+            )
+            short = self._available_gpu_bytes() < entry.footprint
+            if not over_budget and not short:
+                return
+
+            on_gpu = [
+                other
+                for other in self._entries.values()
+                if other.state == ON_GPU and other is not entry
+            ]
+            candidates = [other for other in on_gpu if other.in_use == 0]
+            if candidates:
+                self._evict(min(candidates, key=lambda other: other.last_used))
+                continue
+
+            busy = [other for other in on_gpu if other.name not in self._held_names()]
+            if busy:
+                print(f"[RESIDENCY] {entry.name} waiting for GPU memory")
+                self._released.wait()
+                continue
+
+            if short and not over_budget:
+                # Mémoire tenue par un autre worker ou par Ollama
+                if deadline is None:
+                    deadline = time.monotonic() + self.wait_seconds
+                    print(f"[RESIDENCY] {entry.name} waiting for another process")
+                if time.monotonic() < deadline:
+                    self._released.wait(timeout=1.0)
+                    continue
+
+            # Modèle seul plus gros que le budget, utilisations imbriquées dans
+            # ce thread ou mémoire jamais rendue : attendre ne libérerait rien
+            print(f"[RESIDENCY WARNING] Mémoire GPU insuffisante pour {entry.name}")
+            return
+
+    def _evict(self, entry: _Entry) -> None:
+        started = time.perf_counter()
+        if entry.to_cpu is not None:
+            entry.obj = entry.to_cpu(entry.obj)
+            entry.state = ON_CPU if entry.obj is not None else UNLOADED
+        else:
+            entry.obj = None
+            entry.state = UNLOADED
+        if torch.cuda.is_available():
+            torch.cuda.empty_cache()
+        entry.swaps_out += 1
+        entry.swap_seconds += time.perf_counter() - started
+        print(f"[RESIDENCY] {entry.name} offloaded ({entry.state})")
+
+    def _measure(self, entry: _Entry, *, free_before, allocated_before) -> None:
+        """
+        Add one footprint sample and use the median of the last ones, so that
+        a load overlapping other GPU activity does not skew later decisions.
+        """
+        # Allocations torch de ce processus (pyannote, wav2vec2, VAD) ; la
+        # baisse de mémoire libre couvre en plus CTranslate2, mais aussi ce que
+        # les autres threads et processus allouent au même moment
+        allocated = torch.cuda.memory_allocated() - allocated_before
+        freed = free_before - torch.cuda.mem_get_info()[0]
+        used = max(allocated, freed)
+        if used <= 0:
+            return
+        entry.samples.append(used)
+        entry.footprint = statistics.median(entry.samples)
+
+    def _bring_in(self, entry: _Entry) -> None:
+        free_before = self._free_gpu_bytes()
+        allocated_before = 0
+        if free_before is not None:
+            allocated_before = torch.cuda.memory_allocated()
+        started = time.perf_counter()
+
+        if entry.state == ON_CPU and entry.to_gpu is not None:
+            entry.obj = entry.to_gpu(entry.obj)
+        else:
+            entry.obj = entry.loader()
+            entry.loads += 1
+        entry.state = ON_GPU
+
+        # Retour d'un modèle évincé : c'est un swap, pas un démarrage à froid
+        if entry.swaps_out > entry.swaps_in:
+            entry.swaps_in += 1
+            entry.swap_seconds += time.perf_counter() - started
+
+        if free_before is not None and not entry.fixed and entry.name != "llm":
+            self._measure(
+                entry, free_before=free_before, allocated_before=allocated_before
+            )
+
+    @contextmanager
+    def use(self, name: str):
+        """
+        Make `name` resident for the duration of the block and yield it.
+        A model in use is never evicted; blocks while the GPU is full of
+        models in use by other jobs.
+        """
+        with self._lock:
+            entry = self._entries[name]
+            if entry.state != ON_GPU:
+                self._make_room(entry)
+                # Un autre job a pu le charger pendant l'attente
+                if entry.state != ON_GPU:
+                    self._bring_in(entry)
+            entry.in_use += 1
+            entry.last_used = time.monotonic()
+        self._held_names().append(name)
+        try:
+            yield entry.obj
+        finally:
+            self._held_names().remove(name)
+            with self._lock:
+                entry.in_use -= 1
+                entry.last_used = time.monotonic()
+                self._released.notify_all()
+
+    def is_resident(self, name: str) -> bool:
+        entry = self._entries.get(name)
+        return entry is not None and entry.state == ON_GPU
+
+    def order_stages(self, stages: list[str]) -> list[str]:
+        """
+        Order independent stages so that those whose model is already on the
+        GPU run first, which avoids swapping it out and back in.
+        """
+        with self._lock:
+            return sorted(
+                stages,
+                key=lambda stage: not self.is_resident(STAGE_MODELS.get(stage, stage)),
+            )
+
+    def ollama_keep_alive(self) -> str | int:
+        """
+        keep_alive for the next Ollama call: keep the LLM loaded while it fits
+        the budget; the manager unloads it explicitly when space is needed.
+        """
+        return os.getenv("OLLAMA_KEEP_ALIVE", "30m")
+
+    # ======== MÉTRIQUES ========
+
+    def metrics(self) -> dict:
+        with self._lock:
+            return {
+                "device": self.device,
+                "budget_gb": (
+                    round(self.budget_bytes / GB, 2) if self.budget_bytes else None
+                ),
+                "resident_gb": round(self._resident_bytes() / GB, 2),
+                "swaps": sum(e.swaps_in + e.swaps_out for e in self._entries.values()),
+                "swap_seconds": round(
+                    sum(e.swap_seconds for e in self._entries.values()), 3
+                ),
+                "models": {
+                    entry.name: {
+                        "state": entry.state,
+                        "footprint_gb": round(entry.footprint / GB, 2),
+                        "footprint_samples": len(entry.samples),
+                        "in_use": entry.in_use,
+                        "loads": entry.loads,
+                        "swaps_in": entry.swaps_in,
+                        "swaps_out": entry.swaps_out,
+                        "swap_seconds": round(entry.swap_seconds, 3),
+                    }
+                    for entry in self._entries.values()
+                },
+            }
@@ -84,13 +84,23 @@ async function uploadFile () {
     const firstSpeaker = document.querySelector('input[name="firstSpeaker"]:checked').value;
     formData.append('first_speaker', firstSpeaker);
 
+    // Horodatage par mot : alignement uniquement si demandé
+    const wordTimestamps = document.getElementById('wordTimestamps').checked;
+    formData.append('word_timestamps', wordTimestamps ? 'true' : 'false');
+
     try {
         const response = await fetch('/upload', {
             method: 'POST',
             body: formData
         });
 
-        const data = await response.json();
+        let data = await response.json();
+
+        // Mode flotte : le serveur renvoie un job à suivre
+        if (response.status === 202) {
+            statusDiv.textContent = "En file d'attente...";
+            data = await waitForJob(data.status_url);
+        }
 
         if (response.ok) {
             // Populate Results
@@ -108,6 +118,23 @@ async function uploadFile () {
     }
 }
 
+async function waitForJob (statusUrl) {
+    while (true) {
+        await new Promise(resolve => setTimeout(resolve, 2000));
+        const response = await fetch(statusUrl);
+        const job = await response.json();
+
+        if (!response.ok || job.status === 'failed') {
+            throw new Error(job.error || 'Échec du traitement');
+        }
+        if (job.status === 'done') {
+            statusDiv.textContent = "";
+            return job;
+        }
+        statusDiv.textContent = job.status === 'running' ? 'Traitement en cours...' : "En file d'attente...";
+    }
+}
+
 function displayResults (data) {
     emptyState.classList.add('hidden');
     resultsContent.classList.remove('hidden');
@@ -115,9 +142,12 @@ function displayResults (data) {
     // Populate fields
     if (data.analysis) {
         document.getElementById('transcriptText').textContent = data.analysis.transcript;
-        document.getElementById('summaryText').textContent = data.analysis.summary;
-        document.getElementById('emotionPrimary').textContent = data.analysis.emotions.sentiment;
-        document.getElementById('emotionNote').textContent = `${data.analysis.emotions.note}/10`;
+        // Appels écartés ou traités en "light" par le triage : pas d'analyse LLM
+        const emotions = data.analysis.emotions;
+        const triageReason = data.analysis.triage ? data.analysis.triage.reason : '';
+        document.getElementById('summaryText').textContent = data.analysis.summary ?? `Non analysé (${triageReason})`;
+        document.getElementById('emotionPrimary').textContent = emotions ? emotions.sentiment : 'N/A';
+        document.getElementById('emotionNote').textContent = emotions ? `${emotions.note}/10` : 'N/A';
         document.getElementById('fileFilename').textContent = data.analysis.metadata.filename;
         document.getElementById('fileDuration').textContent = data.analysis.metadata.duration;
         document.getElementById('fileSampleRate').textContent = data.analysis.metadata.sample_rate;
@@ -1,5 +1,7 @@
 import ollama
 
+LLM_MODEL = "llama3"
+
 BASE_PROMPT = """
 Tu es un analyste conversationnel spécialisé dans la relation client assurance (MAIF).
 Tu produis des résumés factuels, neutres et exploitables pour l'amélioration des processus internes.
@@ -48,9 +50,9 @@ Transcription :
 """
 
 
-def summarize(*, transcript: str) -> str:
+def summarize(*, transcript: str, keep_alive=None) -> str:
     print("Starting summary call")
     prompt = BASE_PROMPT.format(transcript=transcript)
-    response = ollama.generate(model="llama3", prompt=prompt)["response"]
+    res = ollama.generate(model=LLM_MODEL, prompt=prompt, keep_alive=keep_alive)
     print("Summary call completed")
-    return response
+    return res["response"]
@@ -0,0 +1,139 @@
+"""
+Cheap triage deciding how much processing a call deserves.
+
+Runs before the expensive pipeline and routes each call to:
+
+* "skip": no usable conversation (almost no speech, voicemail),
+* "light": short call with nothing to summarize (transfer, quick question),
+  transcribed with a small Whisper model and without LLM,
+* "full": large-v2, diarization and the two LLM generations.
+
+The decision uses the rVADfast speech ratio computed by `preprocess_audio`,
+a tiny Whisper pass on the beginning of the call and keyword spotting.
+Thresholds are read from the environment (TRIAGE_*).
+"""
+
+import os
+import re
+import unicodedata
+
+SKIP = "skip"
+LIGHT = "light"
+FULL = "full"
+
+SAMPLE_RATE = 16_000
+
+KEYWORDS = {
+    "voicemail": (
+        "messagerie",
+        "repondeur",
+        "laissez un message",
+        "laisser un message",
+        "apres le bip",
+        "bip sonore",
+        "n'est pas disponible",
+        "rappeler ulterieurement",
+    ),
+    "transfer": (
+        "je vous transfere",
+        "ne quittez pas",
+        "je vous mets en relation",
+        "transferer votre appel",
+        "mauvais service",
+    ),
+    "business": (
+        "sinistre",
+        "contrat",
+        "declaration",
+        "declarer",
+        "franchise",
+        "resiliation",
+        "indemnisation",
+        "expert",
+        "garantie",
+        "cotisation",
+        "reclamation",
+        "devis",
+        "accident",
+        "degat",
+        "remboursement",
+    ),
+}
+
+
+def enabled() -> bool:
+    return os.getenv("TRIAGE", "1").lower() not in {"0", "false", "off"}
+
+
+def thresholds() -> dict:
+    return {
+        "min_speech_ratio": float(os.getenv("TRIAGE_MIN_SPEECH_RATIO", "0.1")),
+        "min_speech_seconds": float(os.getenv("TRIAGE_MIN_SPEECH_SECONDS", "5")),
+        "light_max_seconds": float(os.getenv("TRIAGE_LIGHT_MAX_SECONDS", "90")),
+        "probe_seconds": float(os.getenv("TRIAGE_PROBE_SECONDS", "60")),
+    }
+
+
+def _normalize(text: str) -> str:
+    text = unicodedata.normalize("NFKD", text.lower().replace("’", "'"))
+    text = "".join(c for c in text if not unicodedata.combining(c))
+    return re.sub(r"\s+", " ", text)
+
+
+def spot_keywords(text: str) -> dict:
+    """Keywords found in `text`, per category (accent and case insensitive)."""
+    text = _normalize(text)
+    return {
+        category: [keyword for keyword in keywords if keyword in text]
+        for category, keywords in KEYWORDS.items()
+    }
+
+
+def probe_transcript(model, audio, *, probe_seconds: float) -> str:
+    """Greedy transcription of the beginning of the call with a tiny model."""
+    segments, _ = model.transcribe(
+        audio[: int(probe_seconds * SAMPLE_RATE)],
+        language="fr",
+        beam_size=1,
+        best_of=1,
+        temperature=0.0,
+        condition_on_previous_text=False,
+        vad_filter=False,
+    )
+    return " ".join(segment.text.strip() for segment in segments)
+
+
+def has_enough_speech(stats: dict) -> bool:
+    limits = thresholds()
+    return (
+        stats["speech_seconds"] >= limits["min_speech_seconds"]
+        and stats["speech_ratio"] >= limits["min_speech_ratio"]
+    )
+
+
+def decide(*, stats: dict, probe_text: str | None) -> dict:
+    """
+    Route a call from the preprocessing stats and the tiny-model probe.
+    Returns {"route", "reason", "speech_seconds", "speech_ratio", "keywords"}.
+    """
+    limits = thresholds()
+    decision = {
+        "speech_seconds": round(stats["speech_seconds"], 1),
+        "speech_ratio": round(stats["speech_ratio"], 3),
+        "keywords": {},
+    }
+
+    if not has_enough_speech(stats):
+        return {**decision, "route": SKIP, "reason": "Pas assez de parole"}
+
+    hits = spot_keywords(probe_text or "")
+    decision["keywords"] = {k: v for k, v in hits.items() if v}
+
+    if hits["business"]:
+        return {**decision, "route": FULL, "reason": "Sujet métier détecté"}
+    if hits["voicemail"]:
+        return {**decision, "route": SKIP, "reason": "Messagerie vocale"}
+    if stats["speech_seconds"] <= limits["light_max_seconds"]:
+        reason = "Transfert d'appel" if hits["transfer"] else "Appel court"
+        return {**decision, "route": LIGHT, "reason": reason}
+    return {**decision, "route": FULL, "reason": "Appel long"}
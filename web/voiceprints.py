@@ -0,0 +1,174 @@
+"""
+Operator voiceprint cache.
+
+Enrolled operator embeddings are stored as one on-disk float32 matrix
+(`voiceprints.f32`, one L2-normalised row per enrollment sample) that is
+memory-mapped for lookups, plus a JSON index giving the operator of each row.
+After diarization, the centroid embedding of each speaker cluster is matched
+against the whole matrix with a cosine similarity (a matrix product on
+normalised vectors), so the operator is identified without relying on who
+spoke first.
+"""
+
+import json
+import os
+
+import numpy as np
+from filelock import FileLock
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Lignes de la matrice traitées par bloc lors de la recherche
+MATCH_BLOCK_ROWS = 65_536
+
+
+def _normalize(vectors: np.ndarray) -> np.ndarray:
+    vectors = np.atleast_2d(np.asarray(vectors, dtype=np.float32))
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+
+class VoiceprintStore:
+    def __init__(self, directory: str):
+        self.directory = directory
+        self.matrix_path = os.path.join(directory, "voiceprints.f32")
+        self.index_path = os.path.join(directory, "operators.json")
+        self._lock = FileLock(os.path.join(directory, ".lock"))
+
+        self._index_mtime = None
+        self._operators = []
+        self._dim = None
+        self._matrix = None
+
+        os.makedirs(directory, exist_ok=True)
+
+    # ======== LECTURE ========
+
+    def _refresh(self) -> None:
+        """Reload the index and remap the matrix if another process enrolled."""
+        try:
+            mtime = os.stat(self.index_path).st_mtime_ns
+        except FileNotFoundError:
+            self._operators, self._dim, self._matrix = [], None, None
+            return
+        if mtime == self._index_mtime:
+            return
+
+        with open(self.index_path, "r", encoding="utf-8") as f:
+            index = json.load(f)
+        self._operators = index["operators"]
+        self._dim = index["dim"]
+        self._matrix = (
+            np.memmap(
+                self.matrix_path,
+                dtype=np.float32,
+                mode="r",
+                shape=(len(self._operators), self._dim),
+            )
+            if self._operators
+            else None
+        )
+        self._index_mtime = mtime
+
+    def operators(self) -> dict:
+        """Enrolled operators with their number of enrollment samples."""
+        self._refresh()
+        counts = {}
+        for operator_id in self._operators:
+            counts[operator_id] = counts.get(operator_id, 0) + 1
+        return counts
+
+    def match(self, embeddings: np.ndarray) -> tuple[list, np.ndarray]:
+        """
+        Best enrolled operator for each query embedding.
+        Returns (operator ids, cosine similarities), one entry per query row.
+        """
+        self._refresh()
+        queries = _normalize(embeddings)
+        if self._matrix is None:
+            return [None] * len(queries), np.full(len(queries), -1.0)
+
+        best_scores = np.full(len(queries), -np.inf, dtype=np.float32)
+        best_rows = np.zeros(len(queries), dtype=np.int64)
+        for block in range(0, len(self._operators), MATCH_BLOCK_ROWS):
+            rows = self._matrix[block : block + MATCH_BLOCK_ROWS]
+            scores = queries @ rows.T
+            block_best = scores.argmax(axis=1)
+            block_scores = scores[np.arange(len(queries)), block_best]
+
+            better = block_scores > best_scores
+            best_scores[better] = block_scores[better]
+            best_rows[better] = block + block_best[better]
+
+        return [self._operators[row] for row in best_rows], best_scores
+
+    # ======== ENRÔLEMENT ========
+
+    def enroll(self, *, operator_id: str, embedding: np.ndarray) -> int:
+        """
+        Append one voiceprint sample for `operator_id`.
+        Returns the number of samples enrolled for this operator.
+        """
+        vector = _normalize(embedding)
+        with self._lock:
+            self._index_mtime = None
+            self._refresh()
+            if self._dim is not None and vector.shape[1] != self._dim:
+                raise ValueError(
+                    f"Dimension d'embedding {vector.shape[1]} != {self._dim}"
+                )
+
+            # Ignore une écriture interrompue avant la mise à jour de l'index
+            rows_bytes = len(self._operators) * vector.shape[1] * 4
+            with open(self.matrix_path, "ab") as f:
+                f.truncate(rows_bytes)
+                f.write(vector.tobytes())
+
+            index = {
+                "dim": int(vector.shape[1]),
+                "operators": [*self._operators, operator_id],
+            }
+            tmp_path = f"{self.index_path}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(index, f)
+            os.replace(tmp_path, self.index_path)
+
+        return self.operators()[operator_id]
+
+
+_store = None
+
+
+def get_store() -> VoiceprintStore:
+    global _store
+    if _store is None:
+        default_dir = os.path.join(BASE_DIR, "data", "voiceprints")
+        _store = VoiceprintStore(os.getenv("VOICEPRINT_DIR", default_dir))
+    return _store
+
+
+def identify_operator(speaker_embeddings: dict | None) -> dict | None:
+    """
+    Find which diarization cluster is an enrolled operator.
+    `speaker_embeddings` maps speaker labels to their centroid embedding.
+    Returns {"speaker", "operator_id", "score"} or None if no cluster is
+    close enough to an enrolled voiceprint.
+    """
+    if not speaker_embeddings:
+        return None
+
+    threshold = float(os.getenv("VOICEPRINT_THRESHOLD", "0.5"))
+    labels = list(speaker_embeddings)
+    operator_ids, scores = get_store().match(
+        np.stack([np.asarray(speaker_embeddings[label]) for label in labels])
+    )
+
+    best = int(np.argmax(scores))
+    if operator_ids[best] is None or scores[best] < threshold:
+        return None
+    return {
+        "speaker": labels[best],
+        "operator_id": operator_ids[best],
+        "score": round(float(scores[best]), 3),
+    }
@@ -0,0 +1,165 @@
+"""
+Standalone worker: pulls jobs from the shared queue and runs the
+`web/processor.py` pipeline.
+
+Run one or more workers per GPU host, all pointing at the same queue (with
+several workers on one card, split it with GPU_MEMORY_BUDGET_GB):
+
+    uv run python -m web.worker --db /mnt/shared/vocalis/jobs.db
+
+Several workers can also run on a single machine (one per terminal) to test
+leases and retries locally.
+"""
+
+import argparse
+import os
+import socket
+import threading
+import time
+import traceback
+import uuid
+
+from dotenv import load_dotenv
+
+from . import model_store
+from .jobqueue import SQLiteJobQueue
+
+# Comme web/main.py : avant tout import de whisperx (via processor)
+load_dotenv()
+
+if model_store.is_prepared():
+    model_store.enable_offline()
+else:
+    from . import patch_lightning  # noqa: F401
+
+from . import processor  # noqa: E402
+
+
+class Heartbeat(threading.Thread):
+    """Renew the lease of the running job until stopped."""
+
+    def __init__(self, *, queue, job_id, worker_id, lease_seconds, interval):
+        super().__init__(daemon=True)
+        self.queue = queue
+        self.job_id = job_id
+        self.worker_id = worker_id
+        self.lease_seconds = lease_seconds
+        self.interval = interval
+        self.lost = False
+        self._stop_event = threading.Event()
+
+    def run(self):
+        while not self._stop_event.wait(self.interval):
+            try:
+                alive = self.queue.heartbeat(
+                    self.job_id,
+                    worker_id=self.worker_id,
+                    lease_seconds=self.lease_seconds,
+                )
+            except Exception as e:
+                print(f"[WORKER WARNING] Heartbeat failed ({e})")
+                continue
+            if not alive:
+                print(f"[WORKER WARNING] Lease lost for job {self.job_id}")
+                self.lost = True
+                return
+
+    def stop(self):
+        self._stop_event.set()
+        self.join()
+
+
+def run_job(queue, job, *, worker_id, lease_seconds, heartbeat_interval) -> None:
+    heartbeat = Heartbeat(
+        queue=queue,
+        job_id=job["id"],
+        worker_id=worker_id,
+        lease_seconds=lease_seconds,
+        interval=heartbeat_interval,
+    )
+    heartbeat.start()
+    try:
+        with open(job["audio_path"], "rb") as f:
+            audio_data = f.read()
+
+        options = job["options"]
+        analysis_result = processor.process_wav(
+            audio_data,
+            first_speaker=options.get("first_speaker", "maif"),
+            word_timestamps=options.get("word_timestamps", False),
+            profile=options.get("profile", False),
+        )
+    except Exception as e:
+        heartbeat.stop()
+        traceback.print_exc()
+        queue.fail(job["id"], worker_id=worker_id, error=str(e))
+        return
+
+    heartbeat.stop()
+    if heartbeat.lost:
+        # Le job a été repris par un autre worker, on n'écrase pas son résultat
+        return
+    queue.complete(
+        job["id"],
+        worker_id=worker_id,
+        result={
+            "message": "Fichier téléversé avec succès",
+            "filename": options.get("filename"),
+            "analysis": analysis_result,
+        },
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="VocalisAI worker")
+    parser.add_argument(
+        "--db",
+        default=os.getenv("JOB_QUEUE_DB"),
+        help="Base SQLite de la file partagée (défaut : JOB_QUEUE_DB)",
+    )
+    parser.add_argument(
+        "--worker-id",
+        default=f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:6]}",
+    )
+    parser.add_argument("--lease", type=float, default=120.0, help="Bail (s)")
+    parser.add_argument(
+        "--heartbeat", type=float, default=30.0, help="Renouvellement du bail (s)"
+    )
+    parser.add_argument(
+        "--poll", type=float, default=2.0, help="Attente si la file est vide (s)"
+    )
+    parser.add_argument(
+        "--max-jobs", type=int, default=None, help="S'arrêter après N jobs"
+    )
+    args = parser.parse_args()
+
+    if not args.db:
+        parser.error("--db ou JOB_QUEUE_DB est requis")
+
+    queue = SQLiteJobQueue(
+        args.db, max_attempts=int(os.getenv("JOB_MAX_ATTEMPTS", "3"))
+    )
+    print(f"[WORKER] {args.worker_id} polling {args.db}")
+
+    processed = 0
+    while args.max_jobs is None or processed < args.max_jobs:
+        job = queue.claim(worker_id=args.worker_id, lease_seconds=args.lease)
+        if job is None:
+            time.sleep(args.poll)
+            continue
+
+        print(
+            f"[WORKER] {args.worker_id} running job {job['id']} (try {job['attempt']})"
+        )
+        run_job(
+            queue,
+            job,
+            worker_id=args.worker_id,
+            lease_seconds=args.lease,
+            heartbeat_interval=args.heartbeat,
+        )
+        processed += 1
+
+
+if __name__ == "__main__":
+    main()